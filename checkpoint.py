@@ -0,0 +1,40 @@
+import os
+import pickle
+import zlib
+
+FORMAT_VERSION = 2
+
+
+def save(path, state):
+    """
+    Writes the state into the checkpoint file as a compressed pickle.
+    The file is replaced atomically, so a run interrupted while writing keeps the previous checkpoint.
+    """
+    data = zlib.compress(pickle.dumps((FORMAT_VERSION, state), pickle.HIGHEST_PROTOCOL))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "wb") as checkpoint_file:
+        checkpoint_file.write(data)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load(path):
+    """
+    :return: the state stored in the checkpoint file or None if there is no checkpoint
+        or it was written in another format.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as checkpoint_file:
+        version, state = pickle.loads(zlib.decompress(checkpoint_file.read()))
+    if version != FORMAT_VERSION:
+        return None
+    return state
+
+
+def remove(path):
+    if os.path.exists(path):
+        os.remove(path)
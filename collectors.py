@@ -1,11 +1,15 @@
-import difflib
+import copy
 import enum
 import os
 import re
 
 import matplotlib.pyplot as plt
+import numpy as np
 
-from java_metrics import JavaFile, retrieve_signature
+import similarity
+from git_repo import read_contents
+from java_metrics import extract_methods, is_java_file, retrieve_signature
+from method_state import MethodStateStore
 
 
 class Collector:
@@ -31,19 +35,36 @@ class Collector:
         """Returns collected data as a dictionary {id : collected_data}."""
         pass
 
+    def fork(self):
+        """
+        Returns an independent copy of the collector with the data collected so far. The copy keeps
+        the data of the current commit, while the collector is fed with the next commits, or the other way round.
+        """
+        return copy.deepcopy(self)
+
 
 class MethodCollector(Collector):
-    """Interface for collecting data about methods."""
+    """
+    Interface for collecting data about methods.
+    Methods are reported only when they change: on_added, on_modified, on_moved and on_deleted are called
+    for the changed methods of a commit, then on_commit_end is called once for the commit.
+    """
     image_num = 0
 
-    def __init__(self):
+    def __init__(self, state=None):
+        """
+        :param state: columnar per-method state store, may be shared with other collectors.
+            A new store is created if not given.
+        :type state: method_state.MethodStateStore
+        """
         self.first_commit = True
         self.ID = ""
+        self.state = state if state is not None else MethodStateStore()
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def collect(self, commit, method_id, new_method, old_method, changed=None):
         """
-        Retrieves required data about method from the given data structures to store or process it.
-        Expected to return nothing.
+        Feeds the collector with a single version of a method, translating it into a change event.
+        JavaMethodsDataCollector emits the events itself, this is left for feeding a collector on its own.
 
         Args:
         :param commit: current commit, where new_method_body was extracted from.
@@ -57,10 +78,49 @@ class MethodCollector(Collector):
         :param old_method: method represented in the previous commit.
             None if method was just created.
         :type old_method: java_metrics.Method
+        :param changed: whether the method code changed, see code_changed. It is computed, if not given.
+        :type changed: bool
 
         :return nothing
         :rtype None
         """
+        if new_method is None:
+            if old_method is not None:
+                self.on_deleted(commit, method_id, old_method)
+        elif old_method is None:
+            self.on_added(commit, method_id, new_method)
+        elif self.is_changed(new_method, old_method, changed):
+            self.on_modified(commit, method_id, new_method, old_method)
+        elif new_method.file != old_method.file:
+            self.on_moved(commit, method_id, new_method, old_method)
+
+    def on_added(self, commit, method_id, method):
+        """
+        Called for a method which did not exist in the previous commit. All methods of the first commit are added.
+
+        :type commit: git_repo.Commit
+        :type method_id: int
+        :type method: java_metrics.Method
+        """
+        pass
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        """Called for a method whose code differs from its code in the previous commit."""
+        pass
+
+    def on_moved(self, commit, method_id, new_method, old_method):
+        """Called for a method whose code did not change, but whose file was renamed."""
+        pass
+
+    def on_deleted(self, commit, method_id, old_method):
+        """Called for a method which existed in the previous commit, but does not exist in the current one."""
+        pass
+
+    def on_commit_end(self, commit):
+        """
+        Called after all events of the commit. Methods without events existed in the previous commit and
+        were not changed, they are expected to be handled here all at once.
+        """
         pass
 
     def process(self):
@@ -117,12 +177,15 @@ class MethodCollector(Collector):
         """
         pass
 
-    def flush(self):
-        self.__flush__()
+    def flush(self, commit):
+        self.on_commit_end(commit)
         self.first_commit = False
 
-    def __flush__(self):
-        pass
+    def is_changed(self, new_method, old_method, changed):
+        """Returns the given change verdict or computes it, if it is not given."""
+        if changed is None:
+            return self.code_changed(new_method, old_method)
+        return changed
 
     @staticmethod
     def code_changed(method1, method2):
@@ -131,58 +194,219 @@ class MethodCollector(Collector):
             return False
         if method1 is None or method2 is None:
             return True
-        code1 = method1.code
-        code2 = method2.code
-        if len(code1) != len(code2):
-            return True
-        for old, new in zip(code1, code2):
-            if old != new:
-                return True
-        return False
+        return method1.digest != method2.digest
 
 
 class JavaMethodsDataCollector(Collector):
-    def __init__(self, method_collectors):
+    def __init__(self, method_collectors, parse_cache=None, parse_executor=None, extractor="antlr",
+                 decode_errors="strict", rename_threshold=None):
+        """
+        :param method_collectors: collectors to be fed with methods of every commit.
+        :param parse_cache: persistent storage of already parsed blobs, used to avoid parsing them again.
+        :type parse_cache: parse_cache.ParseCache
+        :param parse_executor: pool of processes the files are parsed in. Files are parsed serially, if not given.
+        :type parse_executor: parse_executor.ParseExecutor
+        :param extractor: name of the method extractor used for serial parsing, see java_metrics.extract_methods.
+        :param decode_errors: decoding error policy used for serial parsing, see java_metrics.decode_code.
+        :param rename_threshold: if given, methods of the renamed java files keep their ids.
+            It is the minimal similarity in percents of a renamed file, see git_repo.Commit.renames.
+        """
         self.ID = "method_data"
         self.method_collectors = method_collectors
+        self.parse_cache = parse_cache
+        self.parse_executor = parse_executor
+        self.extractor = extractor
+        self.decode_errors = decode_errors
+        self.rename_threshold = rename_threshold
+        # path of a java file to the ids of the method signatures seen in it
         self.__method_ids = {}
         self.__id_counter = 0
-        self.__previous_implementations = {}
-
-    def collect(self, commit):
-        current_implementations = {}
-
-        for file in commit.list_objects():
-            _, file_extension = os.path.splitext(file.path)
-            if file_extension != ".java":
-                continue
-
-            content = file.get_content()
-            file_analyzer = JavaFile(content)
-            methods = file_analyzer.eval_blocks()
-
+        # current methods by their ids
+        self.__implementations = {}
+        # path of every java file of the previous commit to its blob sha, its methods and their ids
+        self.__files = {}
+        self.__commit_sha = None
+        self.__parsed_blobs = {}
+
+    def __parse_files(self, files):
+        """
+        Returns methods of the given java files in the same order as files.
+        Files whose blob was parsed for a changed or removed file of the previous commit are not parsed again,
+        the methods parsed before are reused instead. Otherwise the parse cache is checked before parsing the file.
+        """
+        result = []
+        not_parsed = []
+        for file in files:
+            methods = self.__parsed_blobs.get(file.sha)
+            if methods is not None:
+                if methods and methods[0].file != file.path:
+                    # the same blob under another path: methods have to know their own file
+                    methods = [copy.copy(method) for method in methods]
+                    for method in methods:
+                        method.file = file.path
+            elif self.parse_cache is not None:
+                methods = self.parse_cache.get(file.sha)
+            if methods is None:
+                not_parsed.append(len(result))
+            result.append(methods)
+
+        if self.parse_executor is not None:
+            parsed = self.parse_executor.parse([files[i] for i in not_parsed])
+        else:
+            parsed = [extract_methods(content, self.extractor, self.decode_errors)
+                      for content in read_contents([files[i] for i in not_parsed])]
+        for i, methods in zip(not_parsed, parsed):
+            if self.parse_cache is not None:
+                self.parse_cache.put(files[i].sha, methods)
+            result[i] = methods
+
+        for file, methods in zip(files, result):
             for method in methods:
                 method.file = file.path
+        return result
 
-                # mapping signature into the method id
-                full_method_signature = file.path + "::" + method.id
+    def __carry_method_ids(self, renames):
+        """
+        Moves ids of the methods of the renamed files to the new paths of the files,
+        unless methods with the same signatures were already seen under the new path.
 
-                if full_method_signature in self.__method_ids:
-                    method_id = self.__method_ids[full_method_signature]
-                else:
-                    method_id = self.__id_counter
-                    self.__method_ids[full_method_signature] = method_id
-                    self.__id_counter += 1
+        :param renames: dict from the new path of a renamed file to its old path.
+        """
+        # signatures are taken before any ids are moved, so ids are moved only once
+        moves = [(new_path, old_path, list(self.__method_ids.get(old_path, ())))
+                 for new_path, old_path in renames.items()]
+        for new_path, old_path, method_signatures in moves:
+            if not method_signatures:
+                continue
+            old_ids = self.__method_ids[old_path]
+            new_ids = self.__method_ids.setdefault(new_path, {})
+            for method_signature in method_signatures:
+                if method_signature not in new_ids and method_signature in old_ids:
+                    new_ids[method_signature] = old_ids.pop(method_signature)
+
+    def __method_id(self, path, method):
+        """Maps the method signature into the method id."""
+        method_ids = self.__method_ids.setdefault(path, {})
+        if method.id in method_ids:
+            return method_ids[method.id]
+        method_id = self.__id_counter
+        method_ids[method.id] = method_id
+        self.__id_counter += 1
+        return method_id
+
+    def __deepcopy__(self, memo):
+        """Copies the collector for fork. The parse cache, the parse executor and the methods are shared."""
+        result = JavaMethodsDataCollector.__new__(JavaMethodsDataCollector)
+        memo[id(self)] = result
+        memo[id(self.parse_cache)] = self.parse_cache
+        memo[id(self.parse_executor)] = self.parse_executor
+        result.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return result
 
-                old_method = None
-                if method_id in self.__previous_implementations:
-                    old_method = self.__previous_implementations[method_id]
+    def __getstate__(self):
+        """
+        The parse cache and the parse executor are not stored, they have to be set again after the state is restored.
+        Methods are not stored either: every current method is reduced to its digest, and the files of
+        the methods are parsed again when they change or are removed, see __restore_files.
+        """
+        state = self.__dict__.copy()
+        state["parse_cache"] = None
+        state["parse_executor"] = None
+        # private attributes are stored under their mangled names
+        state["_JavaMethodsDataCollector__files"] = {path: (sha, None, method_ids)
+                                                     for path, (sha, _, method_ids) in self.__files.items()}
+        state["_JavaMethodsDataCollector__implementations"] = {
+            method_id: method if isinstance(method, bytes) else method.digest
+            for method_id, method in self.__implementations.items()
+        }
+        return state
+
+    def __restore_files(self, commit, paths):
+        """
+        Parses again the files of the restored state, whose methods were not stored.
+        Methods get back their place among the current methods, if their digest matches the stored one.
+        """
+        files = [commit.file_object(path, self.__files[path][0]) for path in paths]
+        for file, methods in zip(files, self.__parse_files(files)):
+            sha, _, method_ids = self.__files[file.path]
+            for method_id, method in zip(method_ids, methods):
+                if self.__implementations.get(method_id) == method.digest:
+                    self.__implementations[method_id] = method
+            self.__files[file.path] = (sha, methods, method_ids)
+
+    def __changed_files(self, commit):
+        """
+        Returns java files added or changed since the previous collected commit, paths of the removed ones
+        and the commit changes, see git_repo.Commit.changes.
+        They are taken from the commit diff, if the commit is compared with the previous collected commit.
+        Otherwise all files of the commit are listed and compared with the files of the previous collected commit,
+        the commit changes are None then.
+        """
+        if self.__commit_sha is not None and commit.prev_sha == self.__commit_sha:
+            changes = commit.changes(is_java_file)
+            changed_files, removed_files = changes
+            return changed_files, [file.path for file in removed_files], changes
+        files = commit.list_objects(path_filter=is_java_file)
+        paths = {file.path for file in files}
+        return files, [path for path in self.__files if path not in paths], None
+
+    def collect(self, commit):
+        """
+        Feeds the method collectors with the change events of the commit. Only the java files changed
+        since the previous commit are looked at: methods of the added and changed files are compared with
+        their previous versions, methods of the changed and removed files which are not found again are deleted.
+        """
+        changed_files, removed_paths, changes = self.__changed_files(commit)
+        restored = [path for path in removed_paths + [file.path for file in changed_files]
+                    if path in self.__files and self.__files[path][1] is None]
+        if restored:
+            self.__restore_files(commit, restored)
+        if self.rename_threshold is not None and changes is not None and removed_paths and self.__method_ids:
+            renames = commit.renames(changes, self.rename_threshold)
+            if renames:
+                self.__carry_method_ids(renames)
+
+        stale_files = [self.__files.pop(path) for path in removed_paths]
+        files = []
+        for file in changed_files:
+            previous = self.__files.get(file.path)
+            if previous is not None and previous[0] == file.sha:
+                # only the file mode changed
+                continue
+            if previous is not None:
+                stale_files.append(previous)
+            files.append(file)
+        self.__parsed_blobs = {sha: methods for sha, methods, _ in stale_files}
+
+        implementations = {}
+        for file, methods in zip(files, self.__parse_files(files)):
+            method_ids = [self.__method_id(file.path, method) for method in methods]
+            for method_id, method in zip(method_ids, methods):
+                old_method = self.__implementations.get(method_id)
+                if old_method is None:
+                    for collector in self.method_collectors:
+                        collector.on_added(commit, method_id, method)
+                elif MethodCollector.code_changed(method, old_method):
+                    for collector in self.method_collectors:
+                        collector.on_modified(commit, method_id, method, old_method)
+                elif method.file != old_method.file:
+                    for collector in self.method_collectors:
+                        collector.on_moved(commit, method_id, method, old_method)
+                implementations[method_id] = method
+            self.__files[file.path] = (file.sha, methods, method_ids)
+
+        for _, _, method_ids in stale_files:
+            for method_id in method_ids:
+                if method_id in implementations or method_id not in self.__implementations:
+                    continue
+                old_method = self.__implementations.pop(method_id)
                 for collector in self.method_collectors:
-                    collector.collect(commit, method_id, method, old_method)
-                current_implementations[method_id] = method
+                    collector.on_deleted(commit, method_id, old_method)
+        self.__implementations.update(implementations)
         for collector in self.method_collectors:
-            collector.flush()
-        self.__previous_implementations = current_implementations
+            collector.flush(commit)
+        self.__commit_sha = commit.sha
+        self.__parsed_blobs = {}
 
     def process(self):
         result = {}
@@ -222,180 +446,267 @@ class MethodCurrentChangeCollector(MethodCollector):
         MODIFIED = 2
         DELETED = 3
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_change_type"
-        self.__current_changes = set([])
-        self.__change_status = {}
-
-    def collect(self, commit, method_id, method, old_method):
+        self.__current_changes = []
+        # methods added or modified in the previous commit, they are NO_CHANGE now unless changed again
+        self.__previous_changes = []
+        # methods never seen are NOT_EXIST
+        self.__change_status = self.state.add_column(np.int8, self.MethodStatus.NOT_EXIST.__int__())
+
+    def __set_status(self, method_id, status):
+        self.__current_changes.append(method_id)
+        self.state.reserve(method_id)
         # Checking for data initialization commit
         if self.first_commit:
-            self.__current_changes.add(method_id)
-            self.__change_status[method_id] = self.MethodStatus.UNKNOWN.__int__()
-            return
-        if old_method is None:
-            self.__current_changes.add(method_id)
-            self.__change_status[method_id] = self.MethodStatus.ADDED.__int__()
-            return
-        # Then method also existed in the previous commit (not new and not deleted)
-        if self.code_changed(method, old_method):
-            self.__current_changes.add(method_id)
-            self.__change_status[method_id] = self.MethodStatus.MODIFIED.__int__()
-        else:
-            self.__current_changes.add(method_id)
-            self.__change_status[method_id] = self.MethodStatus.NO_CHANGE.__int__()
-        return
+            status = self.MethodStatus.UNKNOWN
+        self.state.column(self.__change_status)[method_id] = status.__int__()
+
+    def on_added(self, commit, method_id, method):
+        self.__set_status(method_id, self.MethodStatus.ADDED)
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__set_status(method_id, self.MethodStatus.MODIFIED)
 
-    def __flush__(self):
-        for method in self.__change_status:
-            if method not in self.__current_changes:
-                self.__change_status[method] = self.MethodStatus.DELETED.__int__()
+    def on_deleted(self, commit, method_id, old_method):
+        self.__set_status(method_id, self.MethodStatus.DELETED)
 
-        self.__current_changes = set([])
+    def on_commit_end(self, commit):
+        # other methods without events keep NO_CHANGE or DELETED
+        change_status = self.state.column(self.__change_status)
+        not_changed = np.setdiff1d(self.__previous_changes, self.__current_changes).astype(np.int64)
+        change_status[not_changed] = self.MethodStatus.NO_CHANGE.__int__()
+
+        current_changes = np.array(self.__current_changes, dtype=np.int64)
+        self.__previous_changes = current_changes[change_status[current_changes] != self.MethodStatus.DELETED]
+        self.__current_changes = []
+
+    def get_statuses(self):
+        """
+        :return: statuses of all methods indexed by the method id, NOT_EXIST for methods never seen.
+        :rtype numpy.ndarray
+        """
+        return self.state.column(self.__change_status)
 
     def get_data(self):
-        return self.__change_status
+        change_status = self.get_statuses()
+        method_ids = np.flatnonzero(change_status != self.MethodStatus.NOT_EXIST)
+        return dict(zip(method_ids.tolist(), change_status[method_ids].tolist()))
 
 
 class MethodLatestChangesCollector(MethodCollector):
-    def __init__(self, stored_changes_max):
-        super().__init__()
+    def __init__(self, stored_changes_max, state=None):
+        super().__init__(state)
         self.ID = "method_latest_changes_types"
-        self.method_current_change_collector = MethodCurrentChangeCollector()
+        self.method_current_change_collector = MethodCurrentChangeCollector(self.state)
         self.__stored_changes_max = stored_changes_max
-        self.__latest_changes = []
+        # circular buffer of the statuses of the last stored_changes_max commits
+        self.__latest_changes = self.state.add_column(np.int8, MethodCurrentChangeCollector.MethodStatus.NOT_EXIST,
+                                                      stored_changes_max)
+        self.__next_slot = 0
+
+    def on_added(self, commit, method_id, method):
+        self.method_current_change_collector.on_added(commit, method_id, method)
 
-    def collect(self, commit, method_id, method, old_method):
-        self.method_current_change_collector.collect(commit, method_id, method, old_method)
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.method_current_change_collector.on_modified(commit, method_id, new_method, old_method)
 
-    def __flush__(self):
-        self.method_current_change_collector.flush()
-        self.__latest_changes.append(self.method_current_change_collector.get_data().copy())
-        while len(self.__latest_changes) > self.__stored_changes_max:
-            self.__latest_changes.pop(0)
+    def on_deleted(self, commit, method_id, old_method):
+        self.method_current_change_collector.on_deleted(commit, method_id, old_method)
+
+    def on_commit_end(self, commit):
+        self.method_current_change_collector.flush(commit)
+        latest_changes = self.state.column(self.__latest_changes)
+        latest_changes[:, self.__next_slot] = self.method_current_change_collector.get_statuses()
+        self.__next_slot = (self.__next_slot + 1) % self.__stored_changes_max
+
+    def get_latest_changes(self):
+        """
+        :return: ids of the methods seen in the stored commits and their statuses in these commits,
+            from the oldest commit to the newest one. Commits before the method appeared are NOT_EXIST.
+        :rtype (numpy.ndarray, numpy.ndarray)
+        """
+        latest_changes = self.state.column(self.__latest_changes)
+        order = (self.__next_slot + np.arange(self.__stored_changes_max)) % self.__stored_changes_max
+        method_ids = np.flatnonzero((latest_changes != MethodCurrentChangeCollector.MethodStatus.NOT_EXIST).any(axis=1))
+        return method_ids, latest_changes[method_ids][:, order]
 
     def get_data(self):
-        result = {}
-        for data_list in self.__latest_changes:
-            for element in data_list:
-                if element not in result:
-                    result[element] = []
-                result[element].append(data_list[element])
-        for method in result:
-            num_to_be_added = self.__stored_changes_max - len(result[method])
-            result[method] = [-1] * num_to_be_added + result[method]
-        return result
+        method_ids, latest_changes = self.get_latest_changes()
+        return dict(zip(method_ids.tolist(), latest_changes.tolist()))
 
 
 class MethodLatestChangesSummary(MethodCollector):
-    def __init__(self, stored_changes_max):
-        super().__init__()
+    def __init__(self, stored_changes_max, state=None):
+        super().__init__(state)
         self.ID = "method_latest_changes_summary"
-        self.method_latest_changes_collector = MethodLatestChangesCollector(stored_changes_max)
+        self.method_latest_changes_collector = MethodLatestChangesCollector(stored_changes_max, self.state)
 
-    def collect(self, commit, method_id, new_method, old_method):
-        self.method_latest_changes_collector.collect(commit, method_id, new_method, old_method)
+    def on_added(self, commit, method_id, method):
+        self.method_latest_changes_collector.on_added(commit, method_id, method)
 
-    def __flush__(self):
-        self.method_latest_changes_collector.__flush__()
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.method_latest_changes_collector.on_modified(commit, method_id, new_method, old_method)
+
+    def on_deleted(self, commit, method_id, old_method):
+        self.method_latest_changes_collector.on_deleted(commit, method_id, old_method)
+
+    def on_commit_end(self, commit):
+        self.method_latest_changes_collector.on_commit_end(commit)
 
     def get_data(self):
-        result = {}
-        data = self.method_latest_changes_collector.get_data()
-        for method, latest_changes in data.items():
-            recently_added = MethodCurrentChangeCollector.MethodStatus.ADDED in latest_changes
-            recently_modified = MethodCurrentChangeCollector.MethodStatus.MODIFIED in latest_changes
-            recently_deleted = MethodCurrentChangeCollector.MethodStatus.DELETED in latest_changes
-            result[method] = [int(recently_added), int(recently_modified), int(recently_deleted)]
-        return result
+        method_ids, latest_changes = self.method_latest_changes_collector.get_latest_changes()
+        summary = np.stack([
+            (latest_changes == MethodCurrentChangeCollector.MethodStatus.ADDED).any(axis=1),
+            (latest_changes == MethodCurrentChangeCollector.MethodStatus.MODIFIED).any(axis=1),
+            (latest_changes == MethodCurrentChangeCollector.MethodStatus.DELETED).any(axis=1)
+        ], axis=1).astype(int)
+        return dict(zip(method_ids.tolist(), summary.tolist()))
 
 
 class MethodCurrentTimeOfLastChangeCollector(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_change_time"
-        self.__change_timestamps = {}
+        self.__changed = self.state.add_column(bool, False)
+        self.__change_timestamps = self.state.add_column(np.int64, 0)
+        self.__exists = self.state.add_column(bool, False)
+        self.__methods_count = 0
+        self.__new_timestamps = {}
         self.__last_commit_timestamp = -1
         self.__first_commit_timestamp = -1
 
-    def collect(self, commit, method_id, method, old_method):
-        if self.__first_commit_timestamp == -1:
-            self.__first_commit_timestamp = commit.committer_time
-        self.__last_commit_timestamp = commit.committer_time
-        if self.code_changed(method, old_method):
-            self.__change_timestamps[method_id] = commit.committer_time
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        exists = self.state.column(self.__exists)
+        if not exists[method_id]:
+            exists[method_id] = True
+            self.__methods_count += 1
+        self.__new_timestamps[method_id] = commit.committer_time
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__new_timestamps[method_id] = commit.committer_time
+
+    def on_deleted(self, commit, method_id, old_method):
+        self.state.column(self.__exists)[method_id] = False
+        self.__methods_count -= 1
+
+    def on_commit_end(self, commit):
+        # only commits with methods are observed
+        if self.__methods_count > 0:
+            if self.__first_commit_timestamp == -1:
+                self.__first_commit_timestamp = commit.committer_time
+            self.__last_commit_timestamp = commit.committer_time
+        if not self.__new_timestamps:
+            return
+        method_ids = np.fromiter(self.__new_timestamps.keys(), np.int64, len(self.__new_timestamps))
+        self.state.column(self.__changed)[method_ids] = True
+        self.state.column(self.__change_timestamps)[method_ids] = list(self.__new_timestamps.values())
+        self.__new_timestamps = {}
+
+    def get_relative_times(self):
+        """
+        :return: time passed since the last change of every method relative to the whole observed time,
+            indexed by the method id. It is 0 for all changed methods, if no time passed, and -1 for methods
+            never changed.
+        :rtype numpy.ndarray
+        """
+        changed = self.state.column(self.__changed)
+        relative_times = np.full(self.state.size, -1.0)
+        observed_time = self.__last_commit_timestamp - self.__first_commit_timestamp
+        relative_times[changed] = 0.0
+        if observed_time != 0:
+            timestamps = self.state.column(self.__change_timestamps)[changed]
+            relative_times[changed] = (self.__last_commit_timestamp - timestamps) / observed_time
+        return relative_times
 
     def get_data(self):
         result = {}
-        for method, timestamp in self.__change_timestamps.items():
+        method_ids = np.flatnonzero(self.state.column(self.__changed))
+        timestamps = self.state.column(self.__change_timestamps)[method_ids]
+        for method, timestamp in zip(method_ids.tolist(), timestamps.tolist()):
             result[method] = (self.__last_commit_timestamp - timestamp) / \
                              (self.__last_commit_timestamp - self.__first_commit_timestamp)
         return result
 
 
 class MethodLatestTimeOfLastChangesCollector(MethodCollector):
-    def __init__(self, stored_changes_max):
-        super().__init__()
+    def __init__(self, stored_changes_max, state=None):
+        super().__init__(state)
         self.ID = "method_latest_change_times"
-        self.__method_current_time_of_last_change = MethodCurrentTimeOfLastChangeCollector()
-        self.__change_timestamps = []
+        self.__method_current_time_of_last_change = MethodCurrentTimeOfLastChangeCollector(self.state)
         self.__stored_changes_max = stored_changes_max
+        # circular buffer of the relative change times of the last stored_changes_max commits
+        self.__change_timestamps = self.state.add_column(np.float64, -1.0, stored_changes_max)
+        self.__next_slot = 0
+
+    def on_added(self, commit, method_id, method):
+        self.__method_current_time_of_last_change.on_added(commit, method_id, method)
 
-    def collect(self, commit, method_id, method, old_method):
-        self.__method_current_time_of_last_change.collect(commit, method_id, method, old_method)
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__method_current_time_of_last_change.on_modified(commit, method_id, new_method, old_method)
 
-    def __flush__(self):
-        self.__method_current_time_of_last_change.flush()
-        self.__change_timestamps.append(self.__method_current_time_of_last_change.get_data().copy())
-        while len(self.__change_timestamps) > self.__stored_changes_max:
-            self.__change_timestamps.pop(0)
+    def on_deleted(self, commit, method_id, old_method):
+        self.__method_current_time_of_last_change.on_deleted(commit, method_id, old_method)
+
+    def on_commit_end(self, commit):
+        self.__method_current_time_of_last_change.flush(commit)
+        change_timestamps = self.state.column(self.__change_timestamps)
+        change_timestamps[:, self.__next_slot] = self.__method_current_time_of_last_change.get_relative_times()
+        self.__next_slot = (self.__next_slot + 1) % self.__stored_changes_max
 
     def get_data(self):
-        result = {}
-        for data_list in self.__change_timestamps:
-            for element in data_list:
-                if result[element] is None:
-                    result[element] = []
-                result[element].append(data_list[element])
-        for method in result:
-            num_to_be_added = self.__stored_changes_max - len(result[method])
-            result[method] = [-1] * num_to_be_added + result[method]
-        return result
+        change_timestamps = self.state.column(self.__change_timestamps)
+        order = (self.__next_slot + np.arange(self.__stored_changes_max)) % self.__stored_changes_max
+        method_ids = np.flatnonzero((change_timestamps != -1.0).any(axis=1))
+        return dict(zip(method_ids.tolist(), change_timestamps[method_ids][:, order].tolist()))
 
 
 class MethodCommitsSinceLastChangeCollector(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_commits_since_last_change"
-        self.__commits_since_last_change = {}
+        self.__changed = self.state.add_column(bool, False)
+        # number of the commit where the method was changed last time
+        self.__last_change = self.state.add_column(np.int64, 0)
+        self.__commits_in_total = 0
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if self.first_commit or self.code_changed(old_method, new_method):
-            self.__commits_since_last_change[method_id] = -1
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        self.state.column(self.__changed)[method_id] = True
+        self.state.column(self.__last_change)[method_id] = self.__commits_in_total
 
-    def __flush__(self):
-        for method in self.__commits_since_last_change:
-            self.__commits_since_last_change[method] += 1
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.state.column(self.__last_change)[method_id] = self.__commits_in_total
+
+    def on_commit_end(self, commit):
+        self.__commits_in_total += 1
 
     def get_data(self):
-        return self.__commits_since_last_change
+        method_ids = np.flatnonzero(self.state.column(self.__changed))
+        commits_since_last_change = self.__commits_in_total - 1 - self.state.column(self.__last_change)[method_ids]
+        return dict(zip(method_ids.tolist(), commits_since_last_change.tolist()))
 
 
 class MethodCommitChangeExpectationCollector(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_commits_change_expectation"
-        self.__commits_since_change_collector = MethodCommitsSinceLastChangeCollector()
-        self.__method_change_ratio = MethodChangeRatio()
+        self.__commits_since_change_collector = MethodCommitsSinceLastChangeCollector(self.state)
+        self.__method_change_ratio = MethodChangeRatio(self.state)
 
-    def collect(self, commit, method_id, new_method, old_method):
-        self.__commits_since_change_collector.collect(commit, method_id, new_method, old_method)
-        self.__method_change_ratio.collect(commit, method_id, new_method, old_method)
+    def on_added(self, commit, method_id, method):
+        self.__commits_since_change_collector.on_added(commit, method_id, method)
+        self.__method_change_ratio.on_added(commit, method_id, method)
 
-    def __flush__(self):
-        self.__commits_since_change_collector.flush()
-        self.__method_change_ratio.flush()
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__commits_since_change_collector.on_modified(commit, method_id, new_method, old_method)
+        self.__method_change_ratio.on_modified(commit, method_id, new_method, old_method)
+
+    def on_commit_end(self, commit):
+        self.__commits_since_change_collector.flush(commit)
+        self.__method_change_ratio.flush(commit)
 
     def get_data(self):
         result = {}
@@ -407,24 +718,40 @@ class MethodCommitChangeExpectationCollector(MethodCollector):
 
 
 class MethodExistenceRatio(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_existence_ratio"
-        self.__counter = {}
+        self.__seen = self.state.add_column(bool, False)
+        self.__exists = self.state.add_column(bool, False)
+        # number of commits the method existed in before it was added last time
+        self.__counter = self.state.add_column(np.int64, 0)
+        self.__added_at = self.state.add_column(np.int64, 0)
         self.__total_commits = 0
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if method_id not in self.__counter:
-            self.__counter[method_id] = 0
-        self.__counter[method_id] += 1
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        exists = self.state.column(self.__exists)
+        if exists[method_id]:
+            return
+        self.state.column(self.__seen)[method_id] = True
+        exists[method_id] = True
+        self.state.column(self.__added_at)[method_id] = self.__total_commits
+
+    def on_deleted(self, commit, method_id, old_method):
+        self.state.column(self.__exists)[method_id] = False
+        commits_existed = self.__total_commits - self.state.column(self.__added_at)[method_id]
+        self.state.column(self.__counter)[method_id] += commits_existed
 
-    def __flush__(self):
+    def on_commit_end(self, commit):
         self.__total_commits += 1
 
     def get_data(self):
         result = {}
 
-        for method, commits_existed in self.__counter.items():
+        commits_since_added = self.__total_commits - self.state.column(self.__added_at)
+        counter = self.state.column(self.__counter) + self.state.column(self.__exists) * commits_since_added
+        method_ids = np.flatnonzero(self.state.column(self.__seen))
+        for method, commits_existed in zip(method_ids.tolist(), counter[method_ids].tolist()):
             result[method] = commits_existed / self.__total_commits
             if result[method] > 1:
                 print(method, commits_existed, self.__total_commits)
@@ -432,33 +759,43 @@ class MethodExistenceRatio(MethodCollector):
 
 
 class MethodFadingLinesChangeRatioCollector(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None, similarity_mode="exact"):
+        """
+        :param similarity_mode: way the new version of a method is compared with the old one, see similarity.ratio.
+        """
+        super().__init__(state)
         self.ID = "method_fading_lines_change_ratio"
-        self.__fading_ratios = {}
+        self.similarity_mode = similarity_mode
+        self.__seen = self.state.add_column(bool, False)
+        self.__fading_ratios = self.state.add_column(np.float64, 0.0)
         self.__new_ratios = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if method_id not in self.__fading_ratios:
-            self.__fading_ratios[method_id] = 0.0
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        seen = self.state.column(self.__seen)
+        if not seen[method_id]:
+            seen[method_id] = True
             return
+        # the method was deleted before
         self.__new_ratios[method_id] = 0.0
-        if old_method is not None:
-            self.__new_ratios[method_id] = difflib.SequenceMatcher(
-                isjunk=lambda x: x in " \t",
-                a="\n".join(new_method.code),
-                b="\n".join(old_method.code)).ratio()
-
-    def __flush__(self):
-        for method, old_ratio in self.__fading_ratios.items():
-            new_ratio = 1.0
-            if method in self.__new_ratios:
-                new_ratio = self.__new_ratios[method]
-            self.__fading_ratios[method] = (new_ratio + old_ratio) / 2
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__new_ratios[method_id] = similarity.ratio(new_method.text, old_method.text, self.similarity_mode)
+
+    def on_commit_end(self, commit):
+        # methods without a new ratio were not changed in the commit
+        new_ratios = np.ones(self.state.size)
+        if self.__new_ratios:
+            method_ids = np.fromiter(self.__new_ratios.keys(), np.int64, len(self.__new_ratios))
+            new_ratios[method_ids] = list(self.__new_ratios.values())
+        seen = self.state.column(self.__seen)
+        fading_ratios = self.state.column(self.__fading_ratios)
+        fading_ratios[seen] = (new_ratios[seen] + fading_ratios[seen]) / 2
         self.__new_ratios = {}
 
     def get_data(self):
-        return self.__fading_ratios
+        method_ids = np.flatnonzero(self.state.column(self.__seen))
+        return dict(zip(method_ids.tolist(), self.state.column(self.__fading_ratios)[method_ids].tolist()))
 
 
 class MethodCommittersCountingCollector(MethodCollector):
@@ -467,11 +804,13 @@ class MethodCommittersCountingCollector(MethodCollector):
         self.ID = "method_commiters_counter"
         self.__committers = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
         if method_id not in self.__committers:
             self.__committers[method_id] = set([])
-        if self.code_changed(new_method, old_method):
-            self.__committers[method_id].add(commit.committer)
+        self.__committers[method_id].add(commit.committer)
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__committers[method_id].add(commit.committer)
 
     def get_data(self):
         result = {}
@@ -490,9 +829,11 @@ class MethodLastCommitterCollector(MethodCollector):
         self.ID = "method_last_committer"
         self.__last_committer = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if self.code_changed(new_method, old_method):
-            self.__last_committer[method_id] = commit.committer
+    def on_added(self, commit, method_id, method):
+        self.__last_committer[method_id] = commit.committer
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__last_committer[method_id] = commit.committer
 
     def get_data(self):
         result = {}
@@ -506,55 +847,75 @@ class MethodLastCommitterCollector(MethodCollector):
 
 
 class MethodChangeRatio(MethodCollector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, state=None):
+        super().__init__(state)
         self.ID = "method_change_ratio"
-        self.__change_info = {}
+        self.__seen = self.state.add_column(bool, False)
+        self.__commits_changed = self.state.add_column(np.int64, 0)
+        # number of commits before the method appeared
+        self.__commits_not_existed = self.state.add_column(np.int64, 0)
         self.__commits_in_total = 0
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if method_id not in self.__change_info:
-            self.__change_info[method_id] = (1, self.__commits_in_total)
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        seen = self.state.column(self.__seen)
+        if not seen[method_id]:
+            seen[method_id] = True
+            self.state.column(self.__commits_changed)[method_id] = 1
+            self.state.column(self.__commits_not_existed)[method_id] = self.__commits_in_total
             return
-        if self.code_changed(new_method, old_method):
-            changed, existed = self.__change_info[method_id]
-            self.__change_info[method_id] = (changed + 1, existed)
+        self.state.column(self.__commits_changed)[method_id] += 1
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.state.column(self.__commits_changed)[method_id] += 1
 
-    def __flush__(self):
+    def on_commit_end(self, commit):
         self.__commits_in_total += 1
 
     def get_data(self):
-        result = {}
-        for key, value in self.__change_info.items():
-            commits_changed, commits_not_existed = value
-            result[key] = commits_changed / (self.__commits_in_total - commits_not_existed)
-        return result
+        method_ids = np.flatnonzero(self.state.column(self.__seen))
+        commits_existed = self.__commits_in_total - self.state.column(self.__commits_not_existed)[method_ids]
+        ratios = self.state.column(self.__commits_changed)[method_ids] / commits_existed
+        return dict(zip(method_ids.tolist(), ratios.tolist()))
 
 
 class MethodLatestChangeRatio(MethodCollector):
-    def __init__(self, stored_changes_max):
-        super().__init__()
+    def __init__(self, stored_changes_max, state=None):
+        super().__init__(state)
         self.__stored_changes_max = stored_changes_max
         self.ID = "method_latest_change_ratio"
-        self.__change_info = {}
-        self.__commits_in_total = 0
-
-    def collect(self, commit, method_id, new_method, old_method):
-        if method_id not in self.__change_info:
-            self.__change_info[method_id] = []
-        if self.code_changed(new_method, old_method):
-            self.__change_info[method_id].append(1)
-        else:
-            self.__change_info[method_id].append(0)
-        if len(self.__change_info[method_id]) > self.__stored_changes_max:
-            self.__change_info[method_id].pop(0)
+        self.__seen = self.state.add_column(bool, False)
+        self.__exists = self.state.add_column(bool, False)
+        self.__changed = self.state.add_column(bool, False)
+        # circular buffer of the changes in the last stored_changes_max commits where the method existed
+        self.__change_info = self.state.add_column(np.int8, 0, stored_changes_max)
+        self.__commits_existed = self.state.add_column(np.int64, 0)
+
+    def on_added(self, commit, method_id, method):
+        self.state.reserve(method_id)
+        self.state.column(self.__seen)[method_id] = True
+        self.state.column(self.__exists)[method_id] = True
+        self.state.column(self.__changed)[method_id] = True
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.state.column(self.__changed)[method_id] = True
+
+    def on_deleted(self, commit, method_id, old_method):
+        self.state.column(self.__exists)[method_id] = False
+
+    def on_commit_end(self, commit):
+        method_ids = np.flatnonzero(self.state.column(self.__exists))
+        changed = self.state.column(self.__changed)
+        commits_existed = self.state.column(self.__commits_existed)
+        slots = commits_existed[method_ids] % self.__stored_changes_max
+        self.state.column(self.__change_info)[method_ids, slots] = changed[method_ids]
+        commits_existed[method_ids] += 1
+        changed[:] = False
 
     def get_data(self):
-        result = {}
-
-        for method, changes in self.__change_info.items():
-            result[method] = changes.count(1) / self.__stored_changes_max
-        return result
+        method_ids = np.flatnonzero(self.state.column(self.__seen))
+        ratios = self.state.column(self.__change_info)[method_ids].sum(axis=1) / self.__stored_changes_max
+        return dict(zip(method_ids.tolist(), ratios.tolist()))
 
 
 # Local metrics #
@@ -569,9 +930,11 @@ class MethodSignatureCollector(MethodCollector):
         self.ID = "method_signature"
         self.__bodies = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
-        if new_method is not None:
-            self.__bodies[method_id] = new_method.code
+    def on_added(self, commit, method_id, method):
+        self.__bodies[method_id] = method.text
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__bodies[method_id] = new_method.text
 
     def clear(self):
         MethodSignatureCollector.name_map = {}
@@ -581,7 +944,7 @@ class MethodSignatureCollector(MethodCollector):
         result = {}
 
         for method_id, body in self.__bodies.items():
-            signature = retrieve_signature("\n".join(body))
+            signature = retrieve_signature(body)
             if signature not in MethodSignatureCollector.name_map:
                 MethodSignatureCollector.name_map[signature] = MethodSignatureCollector.next_free
                 MethodSignatureCollector.next_free += 1
@@ -596,9 +959,12 @@ class MethodLengthCollector(MethodCollector):
         self.ID = "method_length"
         self.__lengths = {}
 
-    def collect(self, commit, method_id, method, old_method):
+    def on_added(self, commit, method_id, method):
         self.__lengths[method_id] = len(method.code)
 
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.__lengths[method_id] = len(new_method.code)
+
     def get_data(self):
         return self.__lengths
 
@@ -609,7 +975,10 @@ class MethodReturnCountingCollector(MethodCollector):
         self.ID = "method_return_counter"
         self.__bodies = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
+        self.__bodies[method_id] = method.code
+
+    def on_modified(self, commit, method_id, new_method, old_method):
         self.__bodies[method_id] = new_method.code
 
     def get_data(self):
@@ -629,8 +998,8 @@ class MethodClassDepthCollector(MethodCollector):
         self.ID = "method_class_depth"
         self.__locations = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
-        self.__locations[method_id] = new_method.location
+    def on_added(self, commit, method_id, method):
+        self.__locations[method_id] = method.location
 
     def get_data(self):
         result = {}
@@ -649,7 +1018,10 @@ class MethodReturnTypeCollector(MethodCollector):
         self.ID = "method_return_type_collector"
         self.__return_types = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
+        self.__return_types[method_id] = method.return_type
+
+    def on_modified(self, commit, method_id, new_method, old_method):
         self.__return_types[method_id] = new_method.return_type
 
     def get_data(self):
@@ -672,7 +1044,10 @@ class MethodMaxLineLengthCollector(MethodCollector):
         self.ID = "method_max_line_length"
         self.__bodies = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
+        self.__bodies[method_id] = method.code
+
+    def on_modified(self, commit, method_id, new_method, old_method):
         self.__bodies[method_id] = new_method.code
 
     def get_data(self):
@@ -692,7 +1067,10 @@ class MethodNumbersCountingCollector(MethodCollector):
         self.ID = "method_numbers_count"
         self.__bodies = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
+        self.__bodies[method_id] = method.code
+
+    def on_modified(self, commit, method_id, new_method, old_method):
         self.__bodies[method_id] = new_method.code
 
     def get_data(self):
@@ -709,7 +1087,10 @@ class MethodAssignmentCountingCollector(MethodCollector):
         self.ID = "method_assignment_count"
         self.__bodies = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
+    def on_added(self, commit, method_id, method):
+        self.__bodies[method_id] = method.code
+
+    def on_modified(self, commit, method_id, new_method, old_method):
         self.__bodies[method_id] = new_method.code
 
     def get_data(self):
@@ -729,8 +1110,14 @@ class MethodDirectoryCollector(MethodCollector):
         self.ID = "method_directory_name_collector"
         self.__directories = {}
 
-    def collect(self, commit, method_id, new_method, old_method):
-        self.__directories[method_id] = new_method.file[:new_method.file.rfind(os.path.sep)]
+    def on_added(self, commit, method_id, method):
+        self.__directories[method_id] = method.file[:method.file.rfind(os.path.sep)]
+
+    def on_modified(self, commit, method_id, new_method, old_method):
+        self.on_added(commit, method_id, new_method)
+
+    def on_moved(self, commit, method_id, new_method, old_method):
+        self.on_added(commit, method_id, new_method)
 
     def get_data(self):
         result = {}
@@ -744,3 +1131,27 @@ class MethodDirectoryCollector(MethodCollector):
     def clear(self):
         MethodDirectoryCollector.dirs = {}
         MethodDirectoryCollector.next_free = 0
+
+
+# numberings of the values shared by all collectors of a class, they have to be stored with the collectors
+_CLASS_STATE = [
+    (MethodCollector, "image_num"),
+    (MethodSignatureCollector, "name_map"),
+    (MethodSignatureCollector, "next_free"),
+    (MethodLastCommitterCollector, "committers"),
+    (MethodLastCommitterCollector, "next_free"),
+    (MethodReturnTypeCollector, "types"),
+    (MethodReturnTypeCollector, "next_free"),
+    (MethodDirectoryCollector, "dirs"),
+    (MethodDirectoryCollector, "next_free")
+]
+
+
+def get_class_state():
+    """Returns the state kept in the class attributes of the collectors, see set_class_state."""
+    return [copy.copy(getattr(cls, name)) for cls, name in _CLASS_STATE]
+
+
+def set_class_state(class_state):
+    for (cls, name), value in zip(_CLASS_STATE, class_state):
+        setattr(cls, name, value)
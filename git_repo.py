@@ -1,20 +1,72 @@
 import os
+import stat
 
 from dulwich import porcelain
-from dulwich.diff_tree import tree_changes
-from dulwich.objects import Tree
+from dulwich.diff_tree import CHANGE_RENAME, RenameDetector
+from dulwich.index import commit_tree
+from dulwich.lru_cache import LRUSizeCache
+from dulwich.object_store import MemoryObjectStore, OverlayObjectStore
+from dulwich.objects import Tree, TreeEntry, hex_to_sha
+from dulwich.pack import OFS_DELTA, REF_DELTA, PackFileDisappeared, apply_delta, chunks_length
+from dulwich.repo import Repo as DulwichRepo
 
 HEADS_PATH = (os.path.join("refs", "heads") + os.sep).encode()
+BACKENDS = ("dulwich", "pygit2")
 
 
 class Repo:
-    def __init__(self, source, destination):
+    def __init__(self, source, destination, repo=None, commits_cache=None, backend="dulwich"):
+        """
+        Clones the source repository into destination.
+
+        :param repo: repository already existing in destination, used instead of a new clone.
+            See open and mirror.
+        :type repo: dulwich.repo.Repo
+        :param commits_cache: directory where the lists of the branch commits are stored between runs,
+            see commit_list.
+        :param backend: library reading trees and blobs of the commits, one of BACKENDS.
+            References and the commit history are always read with dulwich.
+        """
         self.repo_path = destination
         self.source = source
-        self.repo = porcelain.clone(source, destination)
+        self.repo = repo
+        if repo is None:
+            self.repo = porcelain.clone(source, destination)
+            if self.repo is not None:
+                # packs received by the clone are cached closed, BlobReader needs them open
+                self.repo.close()
+                self.repo = DulwichRepo(destination)
+        self.commits_cache = commits_cache
+        # files of the trees listed for the previous commit, reused by the next commit, see Commit.iter_objects
+        self.__listed_trees = {}
 
         if self.repo is None:
             raise ValueError("Repository does not exist")
+        self.backend = create_backend(backend, self.repo)
+
+    @staticmethod
+    def open(path, commits_cache=None, backend="dulwich"):
+        """Opens an existing bare or non-bare local repository in place, without cloning it."""
+        return Repo(path, path, DulwichRepo(path), commits_cache, backend)
+
+    @staticmethod
+    def mirror(source, path, commits_cache=None, backend="dulwich"):
+        """
+        Keeps a persistent bare mirror of the source repository in path. The mirror is created on the first use,
+        later it is only updated with a fetch. Its branches are reset to the branches of the source.
+        """
+        if os.path.isdir(path) and os.listdir(path):
+            repo = DulwichRepo(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            repo = DulwichRepo.init_bare(path)
+        remote_refs = porcelain.fetch(repo, source)
+        branches = {name[len(b"refs/heads/"):]: sha for name, sha in remote_refs.items()
+                    if name.startswith(b"refs/heads/") and not name.endswith(b"^{}")}
+        repo.refs.import_refs(b"refs/heads", branches, prune=True)
+        # reopened for the same reason as after a clone: packs received by the fetch are cached closed
+        repo.close()
+        return Repo(source, path, DulwichRepo(path), commits_cache, backend)
 
     def branch_exists(self, branch_name):
         return branch_name in self.branches_list()
@@ -22,31 +74,86 @@ class Repo:
     def branches_list(self):
         return porcelain.branch_list(self.repo_path)
 
-    def iterate_through_commits(self, branch_name, collectors, from_commit=0, to_commit=int(1e9)):
+    def head_commit(self, branch_name):
+        """Returns the last commit of the branch. It is compared with the empty tree, so all files are changed."""
         if not self.branch_exists(branch_name):
             raise ValueError(b"Branch " + branch_name + b" does not exist")
+        return Commit(self.repo[self.repo[HEADS_PATH + branch_name].id], None, self.repo,
+                      backend=self.backend)
+
+    def commit_list(self, branch_name, first_parent=False):
+        """
+        Returns shas of the branch commits from the oldest one to the newest one, in the order of the dulwich walker.
+        The list is computed once per branch head and stored in commits_cache, if it is given.
+
+        :param first_parent: follow only the first parent of every commit, as git log --first-parent does.
+            Commits brought by the merged branches are skipped.
+        :rtype list[bytes]
+        """
+        if not self.branch_exists(branch_name):
+            raise ValueError(b"Branch " + branch_name + b" does not exist")
+        head = self.repo[HEADS_PATH + branch_name].id
+        cache_path = None
+        if self.commits_cache is not None:
+            cache_path = os.path.join(self.commits_cache,
+                                      ("first-parent-" if first_parent else "commits-") + head.decode())
+            if os.path.exists(cache_path):
+                with open(cache_path, "rb") as cache_file:
+                    return cache_file.read().split()
+
+        if first_parent:
+            shas = [head]
+            parents = self.repo[head].parents
+            while parents:
+                shas.append(parents[0])
+                parents = self.repo[parents[0]].parents
+        else:
+            shas = [entry.commit.id for entry in self.repo.get_walker(include=[head])]
+        shas.reverse()
+        if cache_path is not None:
+            os.makedirs(self.commits_cache, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as cache_file:
+                cache_file.write(b"\n".join(shas))
+            os.replace(cache_path + ".tmp", cache_path)
+        return shas
+
+    def walk_commits(self, branch_name, from_commit=0, to_commit=int(1e9), first_parent=False):
+        """
+        Walks through the branch history from the oldest commit to the newest one.
+        Only the commits in the range and the commit preceding it are read from the repository.
 
-        prev_commit = None
-        i = 0
-        for entry in self.repo.get_walker(include=[self.repo[HEADS_PATH + branch_name].id], reverse=True):
-            if i > to_commit:
-                return
-            commit = entry.commit
-            if from_commit <= i:
-                print("Iterating...", i)
-                for collector in collectors:
-                    collector.collect(Commit(commit, prev_commit, self.repo))
+        :param first_parent: walk only the first parent chain of the branch head, see commit_list.
+            Every commit is then compared with its first parent, so a merge brings only the changes
+            of the merged branch.
+        :return: generator of (commit number, Commit) pairs for commits numbered from from_commit to to_commit
+        """
+        shas = self.commit_list(branch_name, first_parent)
+        prev_commit = self.repo[shas[from_commit - 1]] if 0 < from_commit <= len(shas) else None
+        for i in range(from_commit, min(to_commit + 1, len(shas))):
+            commit = self.repo[shas[i]]
+            yield i, Commit(commit, prev_commit, self.repo, self.__listed_trees, self.backend)
             prev_commit = commit
-            i += 1
 
 
 class Commit:
     _EMPTY_TREE = Tree.from_string(b"")
+    _NULL_ENTRY = TreeEntry(None, None, None)
 
-    def __init__(self, commit, prev_commit, repo):
+    def __init__(self, commit, prev_commit, repo, listed_trees=None, backend=None):
+        """
+        :param listed_trees: files of the unchanged trees listed for another commit, shared between commits.
+            Filled with the trees listed for this commit by iter_objects.
+        :param backend: reader of the trees and the file contents, shared between commits. DulwichBackend by default.
+        """
         self._commit = commit
         self._prev_commit = prev_commit
+        # sha of the commit this one is compared with, None if it is compared with the empty tree
+        self.prev_sha = prev_commit.id if prev_commit is not None else None
         self._repo = repo
+        self._listed_trees = listed_trees if listed_trees is not None else {}
+        # results of changes by the path filter
+        self._changes = {}
+        self.backend = backend if backend is not None else DulwichBackend(repo)
 
         self.author = commit.author.decode()
         self.author_time = commit.author_time
@@ -61,15 +168,162 @@ class Commit:
         else:
             return commit.tree
 
-    def list_objects(self, want_unchanged=True):
+    def renames(self, changes, rename_threshold=60):
+        """
+        Finds the files renamed in the commit with dulwich RenameDetector. Only the removed and the added files
+        of the changes are paired: they are put into two trees kept in memory, so the commit trees are not
+        compared again. Files whose blob did not change are paired first, other files are paired
+        by the similarity of their contents.
+
+        :param changes: result of changes, only the files it reports are paired.
+        :param rename_threshold: minimal similarity in percents of a renamed file to its old version.
+        :return: dict from the new path of a renamed file to its old path.
+        :rtype dict[str, str]
+        """
+        changed, removed = changes
+        added = [file for file in changed if file.old_entry.mode is None]
+        if not removed or not added:
+            return {}
+        trees = MemoryObjectStore()
+        store = OverlayObjectStore([trees, self._repo.object_store], add_store=trees)
+        old_tree = commit_tree(store, [(file.old_entry.path, file.old_entry.sha, file.old_entry.mode)
+                                       for file in removed])
+        new_tree = commit_tree(store, [(file.path.encode(), file.sha.encode(), file.mode) for file in added])
+        detector = RenameDetector(store, rename_threshold=rename_threshold)
+        result = {}
+        for change in detector.changes_with_renames(old_tree, new_tree):
+            if change.type == CHANGE_RENAME:
+                result[change.new.path.decode()] = change.old.path.decode()
+        return result
+
+    def file_object(self, path, sha):
+        """
+        Returns the file of the given path and blob, which is read through the backend of the commit.
+        The file does not have to belong to the commit, it may be a file of another commit of the repository.
+
+        :rtype Object
+        """
+        entry = TreeEntry(path.encode(), stat.S_IFREG | 0o644, sha.encode())
+        return Object(self._repo, self, entry, Commit._NULL_ENTRY)
+
+    def list_objects(self, want_unchanged=True, path_filter=None):
+        return list(self.iter_objects(want_unchanged, path_filter))
+
+    def iter_objects(self, want_unchanged=True, path_filter=None):
+        """
+        Streams the files of the commit in the order of dulwich tree_changes, which compares the commit tree
+        with the tree of the previous commit. Subtrees with the same sha in both trees are not compared:
+        they are skipped, if unchanged files are not wanted, or their files listed for the previous commit
+        are reused.
+
+        :param want_unchanged: list the files not changed in the commit as well.
+        :param path_filter: predicate on the file path, only the files it accepts are listed.
+        :return: generator of Object
+        """
+        listed = {}
+        old_tree = self._prev_commit.tree if self._prev_commit is not None else None
+        yield from self._walk_trees(b"", old_tree, self._commit.tree, want_unchanged, path_filter, listed)
+        if want_unchanged:
+            self._listed_trees.clear()
+            self._listed_trees.update(listed)
+
+    def changes(self, path_filter=None):
+        """
+        Compares the commit tree with the tree of the previous commit, see iter_objects.
+        Subtrees with the same sha in both trees are skipped, so the work depends only on the size of the change.
+        The trees are compared once per path_filter, the result is shared by all callers and must not be modified.
+
+        :param path_filter: predicate on the file path, only the files it accepts are reported.
+        :return: files added or changed in the commit and files removed in it, with their last blob.
+        :rtype (list[Object], list[Object])
+        """
+        changes = self._changes.get(path_filter)
+        if changes is None:
+            removed = []
+            old_tree = self._prev_commit.tree if self._prev_commit is not None else None
+            changed = list(self._walk_trees(b"", old_tree, self._commit.tree, False, path_filter, {}, removed))
+            changes = self._changes[path_filter] = (changed, removed)
+        return changes
+
+    def _walk_trees(self, path, old_tree, new_tree, want_unchanged, path_filter, listed, removed=None):
+        if old_tree == new_tree:
+            if want_unchanged:
+                for entry in self._list_tree(path, new_tree, path_filter, listed):
+                    yield Object(self._repo, self, entry, entry)
+            return
+
+        for old, new in self._merge_entries(path, old_tree, new_tree):
+            old_is_tree = old.mode is not None and stat.S_ISDIR(old.mode)
+            if new.mode is None:
+                if removed is not None:
+                    self._add_removed(old, path_filter, listed, removed)
+                continue
+            if stat.S_ISDIR(new.mode):
+                if removed is not None and old.mode is not None and not old_is_tree:
+                    self._add_removed(old, path_filter, listed, removed)
+                yield from self._walk_trees(new.path, old.sha if old_is_tree else None, new.sha,
+                                            want_unchanged, path_filter, listed, removed)
+                continue
+            if old_is_tree or (old.mode is not None and stat.S_IFMT(old.mode) != stat.S_IFMT(new.mode)):
+                # file type changed: reported as a new file
+                if removed is not None and old_is_tree:
+                    self._add_removed(old, path_filter, listed, removed)
+                old = Commit._NULL_ENTRY
+            if old == new and not want_unchanged:
+                continue
+            if path_filter is None or path_filter(new.path.decode()):
+                yield Object(self._repo, self, new, old)
+
+    def _add_removed(self, entry, path_filter, listed, removed):
+        """Adds the removed file or the files of the removed tree accepted by path_filter."""
+        if stat.S_ISDIR(entry.mode):
+            removed += [Object(self._repo, self, file, file)
+                        for file in self._list_tree(entry.path, entry.sha, path_filter, listed)]
+        elif path_filter is None or path_filter(entry.path.decode()):
+            removed.append(Object(self._repo, self, entry, entry))
+
+    def _list_tree(self, path, tree, path_filter, listed):
+        """Returns entries of the files in the tree and its subtrees accepted by path_filter."""
+        key = (path, tree, path_filter)
+        entries = self._listed_trees.get(key)
+        if entries is None:
+            entries = listed.get(key)
+        if entries is None:
+            entries = []
+            for entry in self.backend.tree_entries(tree, path):
+                if stat.S_ISDIR(entry.mode):
+                    entries += self._list_tree(entry.path, entry.sha, path_filter, listed)
+                elif path_filter is None or path_filter(entry.path.decode()):
+                    entries.append(entry)
+        listed[key] = entries
+        return entries
+
+    def _merge_entries(self, path, old_tree, new_tree):
+        """Pairs the entries of two trees by name, missing entries are replaced with _NULL_ENTRY."""
+        old_entries = self._tree_entries(path, old_tree)
+        new_entries = self._tree_entries(path, new_tree)
         result = []
-        for tree_change in tree_changes(self._repo.object_store,
-                                        self.get_tree(self._prev_commit), self.get_tree(self._commit),
-                                        want_unchanged=want_unchanged):
-            if tree_change.new[0] is not None:
-                result.append(Object(self._repo, self, tree_change.new, tree_change.old))
+        i = j = 0
+        while i < len(old_entries) and j < len(new_entries):
+            if old_entries[i].path < new_entries[j].path:
+                result.append((old_entries[i], Commit._NULL_ENTRY))
+                i += 1
+            elif old_entries[i].path > new_entries[j].path:
+                result.append((Commit._NULL_ENTRY, new_entries[j]))
+                j += 1
+            else:
+                result.append((old_entries[i], new_entries[j]))
+                i += 1
+                j += 1
+        result += [(entry, Commit._NULL_ENTRY) for entry in old_entries[i:]]
+        result += [(Commit._NULL_ENTRY, entry) for entry in new_entries[j:]]
         return result
 
+    def _tree_entries(self, path, tree):
+        if tree is None:
+            return []
+        return self.backend.tree_entries(tree, path)
+
 
 class Object:
     def __init__(self, repo, commit, new, old):
@@ -80,8 +334,160 @@ class Object:
         self.path = self.path.decode()
         self.sha = self.sha.decode()
 
-    def get_content(self):
+    @property
+    def old_entry(self):
+        """
+        Entry of the file in the previous commit, its fields are None if the file is new.
+
+        :rtype dulwich.objects.TreeEntry
+        """
+        return self._old_version
+
+    def get_raw_content(self):
+        """Returns the blob content as a single bytes object, without splitting it into lines."""
         if self.sha is None:
             return None
         else:
-            return self._repo.object_store[self.sha].splitlines()
+            return self._commit.backend.read_blobs([self.sha])[self.sha]
+
+
+def read_contents(files):
+    """
+    Reads raw contents of the files at once, in the order their blobs are stored in the packs.
+    The files may belong to different commits of the same repository.
+
+    :type files: list[Object]
+    :return: list of the contents in the same order as files.
+    :rtype list[bytes]
+    """
+    if not files:
+        return []
+    contents = files[0]._commit.backend.read_blobs([file.sha for file in files])
+    return [contents[file.sha] for file in files]
+
+
+def create_backend(name, repo):
+    """
+    :param name: one of BACKENDS.
+    :param repo: repository the backend reads.
+    :type repo: dulwich.repo.Repo
+    """
+    if name == "dulwich":
+        return DulwichBackend(repo)
+    if name == "pygit2":
+        return Pygit2Backend(repo)
+    raise ValueError("Unknown backend " + name)
+
+
+class DulwichBackend:
+    """Reads trees and blobs with dulwich, blobs are read in pack order by BlobReader."""
+
+    def __init__(self, repo):
+        self._object_store = repo.object_store
+        self._blob_reader = BlobReader(repo.object_store)
+
+    def tree_entries(self, tree, path):
+        """
+        :param tree: hex sha of the tree.
+        :param path: path of the tree, prepended to the entry names.
+        :return: entries of the tree sorted by name.
+        :rtype list[dulwich.objects.TreeEntry]
+        """
+        return [entry.in_path(path) for entry in self._object_store[tree].iteritems(name_order=True)]
+
+    def read_blobs(self, shas):
+        """
+        :param shas: hex shas of the blobs.
+        :type shas: list[str]
+        :return: dict from the sha to the raw blob content.
+        :rtype dict[str, bytes]
+        """
+        return self._blob_reader.read(shas)
+
+
+class Pygit2Backend:
+    """
+    Reads trees and blobs with libgit2 through pygit2, which has to be installed.
+    The entries are the same as DulwichBackend returns, so the commit files are listed in the same order.
+    """
+
+    def __init__(self, repo):
+        import pygit2
+        self._repo = pygit2.Repository(repo.path)
+
+    def tree_entries(self, tree, path):
+        """See DulwichBackend.tree_entries."""
+        entries = [TreeEntry(entry.raw_name, entry.filemode, str(entry.id).encode()).in_path(path)
+                   for entry in self._repo[tree.decode()]]
+        entries.sort(key=lambda entry: entry.path)
+        return entries
+
+    def read_blobs(self, shas):
+        """See DulwichBackend.read_blobs."""
+        return {sha: self._repo[sha].read_raw() for sha in shas}
+
+
+class BlobReader:
+    """
+    Reads many blobs at once. Packed blobs are read in the order of their offsets in the pack, and the resolved
+    delta bases are kept in a bounded LRU cache, so a delta chain shared by the blobs is resolved only once
+    and the pack file is read sequentially. Loose blobs are read one by one.
+    """
+
+    def __init__(self, object_store, cache_size=64 * 1024 * 1024):
+        """
+        :param cache_size: maximal total size in bytes of the cached delta bases.
+        """
+        self._object_store = object_store
+        self._bases = LRUSizeCache(cache_size, compute_size=chunks_length)
+
+    def read(self, shas):
+        """
+        :param shas: hex shas of the blobs.
+        :type shas: list[str]
+        :return: dict from the sha to the raw blob content.
+        :rtype dict[str, bytes]
+        """
+        result = {}
+        located = []
+        packs = list(self._object_store.packs)
+        for sha in set(shas):
+            binary_sha = hex_to_sha(sha.encode())
+            for pack_num, pack in enumerate(packs):
+                try:
+                    located.append((pack_num, pack.index.object_index(binary_sha), sha))
+                    break
+                except (KeyError, PackFileDisappeared):
+                    pass
+            else:
+                result[sha] = self._object_store[sha.encode()].as_raw_string()
+        for pack_num, offset, sha in sorted(located):
+            chunks = self._resolve(pack_num, packs[pack_num], offset)
+            if chunks is None:
+                chunks = [self._object_store[sha.encode()].as_raw_string()]
+            result[sha] = b"".join(chunks)
+        return result
+
+    def _resolve(self, pack_num, pack, offset):
+        """
+        Returns chunks of the object at the offset of the pack.
+        Deltas against a base referenced by sha are left to dulwich, None is returned for them.
+        """
+        deltas = []
+        chunks = self._bases.get((pack_num, offset))
+        while chunks is None:
+            type_num, obj = pack.data.get_object_at(offset)
+            if type_num == REF_DELTA:
+                return None
+            if type_num != OFS_DELTA:
+                chunks = obj
+                self._bases[(pack_num, offset)] = chunks
+                break
+            delta_offset, delta = obj
+            deltas.append((offset, delta))
+            offset -= delta_offset
+            chunks = self._bases.get((pack_num, offset))
+        for offset, delta in reversed(deltas):
+            chunks = apply_delta(chunks, delta)
+            self._bases[(pack_num, offset)] = chunks
+        return chunks
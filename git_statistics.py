@@ -1,12 +1,19 @@
 #! /bin/python3
 
+import collections
 import os
 import tempfile
 import traceback
 from argparse import ArgumentParser
 
+import checkpoint
 import collectors
 import git_repo
+import java_metrics
+import method_state
+import parse_cache
+import parse_executor
+import similarity
 
 
 def writeDataOnDisk(data, directory, file):
@@ -19,56 +26,271 @@ def writeDataOnDisk(data, directory, file):
             file.writelines("\n")
 
 
+def writeTestData(collectors_list, directory, window):
+    for collector in collectors_list:
+        writeDataOnDisk(collector.get_data(), directory, "test" + window.__str__())
+
+
+def writeResultData(collectors_list, directory, window):
+    for collector in collectors_list:
+        writeDataOnDisk(collector.process(), directory, "result" + window.__str__())
+
+
+def warmUpSamples(repo, branch, count):
+    """Returns the code of up to count java files of the branch head."""
+    samples = []
+    try:
+        for file in repo.head_commit(branch).iter_objects(path_filter=java_metrics.is_java_file):
+            if len(samples) >= count:
+                break
+            samples.append(java_metrics.decode_code(file.get_raw_content(), "replace"))
+    except Exception:
+        traceback.print_exc()
+    return samples
+
+
+def create_collectors(result_gap, cache=None, executor=None, extractor="antlr", decode_errors="strict",
+                      rename_threshold=None, similarity_mode="exact"):
+    state = method_state.MethodStateStore()
+    return [
+        collectors.JavaMethodsDataCollector(
+            [
+                collectors.MethodSignatureCollector(),
+                collectors.MethodCommitsSinceLastChangeCollector(state),
+                collectors.MethodFadingLinesChangeRatioCollector(state, similarity_mode),
+                collectors.MethodCurrentTimeOfLastChangeCollector(state),
+                collectors.MethodLatestChangesSummary(result_gap, state),
+                collectors.MethodChangeRatio(state)
+            ],
+            parse_cache=cache,
+            parse_executor=executor,
+            extractor=extractor,
+            decode_errors=decode_errors,
+            rename_threshold=rename_threshold
+        )
+    ]
+
+
+def lookahead(commits, executor, depth):
+    """
+    Passes the commits through, submitting files changed in the next depth commits to the parse executor.
+    The commits are submitted in batches of depth commits, so the blobs of a batch are read together.
+    The parses of a batch which were not taken are released once the batch is processed.
+    """
+    queue = collections.deque()
+    batch = []
+    for commit_num, commit in commits:
+        batch.append((commit_num, commit))
+        if len(batch) < depth:
+            continue
+        executor.prefetch([commit for _, commit in batch])
+        queue.extend(batch)
+        batch = []
+        while len(queue) > depth:
+            passed = queue.popleft()
+            yield passed
+            # the commit is processed, when the next one is asked for
+            executor.release(passed[1])
+    executor.prefetch([commit for _, commit in batch])
+    queue.extend(batch)
+    while queue:
+        passed = queue.popleft()
+        yield passed
+        executor.release(passed[1])
+
+
+def load_checkpoint(repo, branch, path, options, first_parent=False):
+    """
+    Returns the run state stored in the checkpoint file, if it was written by a run with the same options
+    and its last collected commit has the same number in the branch history. Returns None otherwise.
+    """
+    state = checkpoint.load(path)
+    if state is None:
+        return None
+    if state["options"] != options:
+        print("Checkpoint", path, "was written with other options, it is ignored")
+        return None
+    shas = repo.commit_list(branch, first_parent)
+    if state["commit_num"] >= len(shas) or shas[state["commit_num"]] != state["commit_sha"]:
+        print("Checkpoint", path, "does not match the branch history, it is ignored")
+        return None
+    return state
+
+
+def collect_windows(repo, branch, destination, windows, per_file, result_gap, cache=None, executor=None,
+                    parse_lookahead=0, extractor="antlr", decode_errors="strict", first_parent=False,
+                    rename_threshold=None, similarity_mode="exact", checkpoint_path=None, checkpoint_interval=100):
+    """
+    Splits the branch history into consecutive windows of per_file commits and walks through it only once.
+    Every window gets its own collectors, which are fed with the window commits. The collectors are forked
+    result_gap commits before the window end to keep the "test" data of the window, both the "test" and
+    the "result" data are written at the window end.
+
+    :param checkpoint_path: file where the state of the run is stored every checkpoint_interval commits.
+        If it holds the state of an interrupted run with the same options, the run is resumed from it.
+        The file is removed when the run is over.
+    """
+    collectors_list = None
+    test_collectors = None
+    next_window = 0
+    from_commit = 0
+    options = {"branch": branch, "windows": windows, "per_file": per_file, "result_gap": result_gap,
+               "extractor": extractor, "decode_errors": decode_errors, "first_parent": first_parent,
+               "rename_threshold": rename_threshold, "similarity_mode": similarity_mode}
+    if checkpoint_path is not None:
+        try:
+            state = load_checkpoint(repo, branch, checkpoint_path, options, first_parent)
+        except Exception:
+            traceback.print_exc()
+            state = None
+        if state is not None:
+            print("Resuming after commit", state["commit_num"])
+            collectors.set_class_state(state["class_state"])
+            collectors_list = state["collectors"]
+            test_collectors = state["test_collectors"]
+            next_window = state["next_window"]
+            from_commit = state["commit_num"] + 1
+            for collector in collectors_list or []:
+                if isinstance(collector, collectors.JavaMethodsDataCollector):
+                    collector.parse_cache = cache
+                    collector.parse_executor = executor
+    try:
+        commits = repo.walk_commits(branch, from_commit=from_commit, to_commit=per_file * windows - 1,
+                                    first_parent=first_parent)
+        if executor is not None and parse_lookahead > 0:
+            commits = lookahead(commits, executor, parse_lookahead)
+        for commit_num, commit in commits:
+            window, offset = divmod(commit_num, per_file)
+            if offset == 0:
+                collectors_list = create_collectors(result_gap, cache, executor, extractor, decode_errors,
+                                                    rename_threshold, similarity_mode)
+                test_collectors = None
+                next_window = window + 1
+            # if the window has failed, the rest of its commits are skipped
+            if collectors_list is not None:
+                print("Iterating...", commit_num)
+                try:
+                    for collector in collectors_list:
+                        collector.collect(commit)
+                    if offset == per_file - 1 - result_gap:
+                        test_collectors = [collector.fork() for collector in collectors_list]
+                    if offset == per_file - 1:
+                        writeTestData(test_collectors, destination, window)
+                        writeResultData(collectors_list, destination, window)
+                        collectors_list = None
+                except Exception:
+                    traceback.print_exc()
+                    collectors_list = None
+            if checkpoint_path is not None and (commit_num + 1) % checkpoint_interval == 0:
+                checkpoint.save(checkpoint_path, {
+                    "options": options,
+                    "commit_num": commit_num,
+                    "commit_sha": commit.sha,
+                    "collectors": collectors_list,
+                    "test_collectors": test_collectors,
+                    "next_window": next_window,
+                    "class_state": collectors.get_class_state()
+                })
+    except Exception:
+        traceback.print_exc()
+        return
+
+    # the history is over: the unfinished window is written as it is, the windows after it are empty
+    try:
+        if collectors_list is not None:
+            writeTestData(test_collectors if test_collectors is not None else collectors_list, destination,
+                          next_window - 1)
+            writeResultData(collectors_list, destination, next_window - 1)
+        for window in range(next_window, windows):
+            collectors_list = create_collectors(result_gap, cache, executor, extractor, decode_errors,
+                                                rename_threshold, similarity_mode)
+            writeTestData(collectors_list, destination, window)
+            writeResultData(collectors_list, destination, window)
+        if checkpoint_path is not None:
+            checkpoint.remove(checkpoint_path)
+    except Exception:
+        traceback.print_exc()
+
+
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--repository", help="url to the git repository")
+    parser.add_argument("--local", help="open the local repository given by --repository in place "
+                                        "instead of cloning it", action="store_true")
+    parser.add_argument("--mirror", help="directory of a persistent bare mirror of the repository, "
+                                         "it is cloned on the first run and only fetched later")
+    parser.add_argument("--backend", help="library reading trees and blobs of the commits",
+                        choices=git_repo.BACKENDS, default="dulwich")
+    parser.add_argument("--commits-cache", help="directory where the lists of the branch commits are stored "
+                                                "between runs")
     parser.add_argument("--destination", help="directory where all calculated data will be put into", default="data")
     parser.add_argument("--branch", help="branch that will be observed", default="master")
+    parser.add_argument("--windows", help="number of commit windows to be processed", type=int, default=20)
+    parser.add_argument("--window-size", help="number of commits in a window", type=int, default=110)
+    parser.add_argument("--result-gap", help="number of the last window commits used only for the result data",
+                        type=int, default=10)
+    parser.add_argument("--first-parent", help="walk only the first parent chain of the branch, skipping the commits "
+                                               "of the merged branches: every commit is compared with its first "
+                                               "parent, so a merge brings only the merged changes",
+                        action="store_true")
+    parser.add_argument("--detect-renames", help="keep ids of the methods of renamed java files",
+                        action="store_true")
+    parser.add_argument("--rename-threshold", help="minimal similarity in percents of a renamed file "
+                                                   "to its old version", type=int, default=60)
+    parser.add_argument("--similarity", help="way of comparing method versions for the fading lines change ratio: "
+                                             "exact difflib ratio, Myers diff of the lines or difflib upper bounds",
+                        choices=similarity.MODES, default="exact")
+    parser.add_argument("--checkpoint", help="file where the state of the run is stored from time to time, "
+                                             "an interrupted run is resumed from it")
+    parser.add_argument("--checkpoint-interval", help="number of commits between the checkpoints",
+                        type=int, default=100)
+    parser.add_argument("--parse-cache", help="file of the persistent parse cache, which is reused between runs")
+    parser.add_argument("--parse-cache-size", help="maximal number of blobs stored in the parse cache",
+                        type=int, default=1000000)
+    parser.add_argument("--parse-workers", help="number of processes parsing java files, 0 to parse them serially",
+                        type=int, default=0)
+    parser.add_argument("--parse-lookahead", help="number of the upcoming commits whose files are parsed in advance",
+                        type=int, default=10)
+    parser.add_argument("--extractor", help="way of finding methods in java files: the full ANTLR parse tree "
+                                            "(SLL prediction first or LL only) or the faster token scanner",
+                        choices=java_metrics.EXTRACTORS, default="antlr")
+    parser.add_argument("--decode-errors", help="policy for java files which are not valid UTF-8",
+                        choices=["strict", "replace", "ignore"], default="strict")
+    parser.add_argument("--warm-up-files", help="number of java files every parse worker parses before the real work "
+                                                "to warm up its parser", type=int, default=20)
     args = parser.parse_args()
     destination = args.destination
 
     repo_url = args.repository
     branch = args.branch.encode()
 
+    cache = None
+    if args.parse_cache is not None:
+        cache = parse_cache.ParseCache(args.parse_cache, args.parse_cache_size, args.extractor,
+                                       args.decode_errors)
+
+    executor = None
     with tempfile.TemporaryDirectory() as tmpdir:
-        repo = git_repo.Repo(repo_url, tmpdir)
-        per_file = 110
-        result_gap = 10
-        for i in range(0, 20):
-            start_commit = per_file * i
-            end_commit = per_file * (i + 1) - 1
-            collectors_list_main = [
-                collectors.JavaMethodsDataCollector(
-                    [
-                        collectors.MethodSignatureCollector(),
-                        collectors.MethodCommitsSinceLastChangeCollector(),
-                        collectors.MethodFadingLinesChangeRatioCollector(),
-                        collectors.MethodCurrentTimeOfLastChangeCollector(),
-                        collectors.MethodLatestChangesSummary(result_gap),
-                        collectors.MethodChangeRatio()
-                    ]
-                )
-            ]
-            collectors_list_result = [
-                collectors.JavaMethodsDataCollector(
-                    [
-                        collectors.MethodSignatureCollector(),
-                        collectors.MethodCommitsSinceLastChangeCollector(),
-                        collectors.MethodFadingLinesChangeRatioCollector(),
-                        collectors.MethodCurrentTimeOfLastChangeCollector(),
-                        collectors.MethodLatestChangesSummary(result_gap),
-                        collectors.MethodChangeRatio()
-                    ]
-                )
-            ]
-            try:
-                repo.iterate_through_commits(branch, collectors_list_main,
-                                             from_commit=start_commit, to_commit=end_commit - result_gap)
-                for collector in collectors_list_main:
-                    writeDataOnDisk(collector.get_data(), destination, "test" + i.__str__())
-                repo.iterate_through_commits(branch, collectors_list_result,
-                                             from_commit=start_commit, to_commit=end_commit)
-                for collector in collectors_list_result:
-                    writeDataOnDisk(collector.process(), destination, "result" + i.__str__())
-            except Exception:
-                traceback.print_exc()
+        if args.local:
+            repo = git_repo.Repo.open(repo_url, args.commits_cache, args.backend)
+        elif args.mirror is not None:
+            repo = git_repo.Repo.mirror(repo_url, args.mirror, args.commits_cache, args.backend)
+        else:
+            repo = git_repo.Repo(repo_url, tmpdir, commits_cache=args.commits_cache, backend=args.backend)
+        if args.parse_workers > 0:
+            samples = warmUpSamples(repo, branch, args.warm_up_files) if args.warm_up_files > 0 else []
+            executor = parse_executor.ParseExecutor(args.parse_workers, cache, args.extractor, samples,
+                                                    args.decode_errors)
+        collect_windows(repo, branch, destination, args.windows, args.window_size, args.result_gap,
+                        cache, executor, args.parse_lookahead, args.extractor, args.decode_errors,
+                        args.first_parent,
+                        args.rename_threshold if args.detect_renames else None, args.similarity,
+                        args.checkpoint, args.checkpoint_interval)
+
+    print("Files parsed:", java_metrics.parse_statistics["files"],
+          "SLL fallbacks:", java_metrics.parse_statistics["sll_fallbacks"],
+          "scanner fallbacks:", java_metrics.parse_statistics["scanner_fallbacks"])
+    if executor is not None:
+        executor.close()
+    if cache is not None:
+        cache.close()
@@ -1,30 +1,43 @@
 from antlr4 import *
+import bisect
+import collections
+import hashlib
+import os
 import re
 
 from antlr_java_parser.JavaLexer import JavaLexer
 from antlr_java_parser.JavaParser import JavaParser
 from antlr_java_parser.JavaParserListener import JavaParserListener
+from parser_factory import get_factory
 
 
-class ClassCountingListener(JavaParserListener):
-    def __init__(self):
-        self.count = 0
+class JavaFileSummary:
+    """Everything collected from a java file by a single walk through its parse tree."""
 
-    def enterClassDeclaration(self, ctx: JavaParser.ClassDeclarationContext):
-        self.count += 1
+    def __init__(self):
+        self.classes_count = 0
+        # all method declarations, including ones of the classes declared inside method bodies
+        self.methods_count = 0
+        # top-level methods, see JavaFile.eval_blocks
+        self.methods = []
+        self.max_class_depth = 0
 
 
-class MethodsCountingListener(JavaParserListener):
-    def __init__(self, tokens_stream):
-        self.count = 0
-        self.tokens = tokens_stream
-        self.blocks = set([])
+class JavaFileSummaryListener(JavaParserListener):
+    def __init__(self, code):
+        self.code = code
+        self.line_starts = line_starts(code)
+        self.summary = JavaFileSummary()
         self.__nested_in = []
         self.__in_method_counter = 0
-        self.__current_method = None
+
+    def __text(self, ctx):
+        return self.code[ctx.start.start:ctx.stop.stop + 1]
 
     def enterClassDeclaration(self, ctx: JavaParser.ClassDeclarationContext):
         self.__nested_in.append(ctx.IDENTIFIER().getText())
+        self.summary.classes_count += 1
+        self.summary.max_class_depth = max(self.summary.max_class_depth, len(self.__nested_in))
 
     def exitClassDeclaration(self, ctx: JavaParser.ClassDeclarationContext):
         self.__nested_in.pop(-1)
@@ -37,12 +50,10 @@ class MethodsCountingListener(JavaParserListener):
 
     def enterMethodDeclaration(self, ctx: JavaParser.MethodDeclarationContext):
         if self.__in_method_counter == 0:
-            method_type = self.tokens.getText(interval=(ctx.typeTypeOrVoid().start.tokenIndex,
-                                                        ctx.typeTypeOrVoid().stop.tokenIndex))
-            method_declaration = self.tokens.getText(interval=(ctx.start.tokenIndex, ctx.stop.tokenIndex))
-            method = Method(method_declaration, ".".join(self.__nested_in), method_type)
-            self.blocks.add(method)
-        self.count += 1
+            method = Method(self.__text(ctx), ".".join(self.__nested_in), self.__text(ctx.typeTypeOrVoid()),
+                            lines_span=lines_span(self.line_starts, ctx.start.start, ctx.stop.stop))
+            self.summary.methods.append(method)
+        self.summary.methods_count += 1
 
 
 def retrieve_signature(first_line: str):
@@ -101,38 +112,388 @@ def retrieve_signature(first_line: str):
     return first_line.replace(" ", '')
 
 
+def is_java_file(path):
+    _, file_extension = os.path.splitext(path)
+    return file_extension == ".java"
+
+
+# counters of the parsed files, see extract_methods
+parse_statistics = collections.Counter()
+
+
+_LINE_END = re.compile(r"(\r\n|\r(?!\n)|\n)(?!\Z)")
+# a line ending of the file followed by the "\n" added by decode_code
+_DECODED_LINE_END = re.compile(r"(?:\r\n|\r|\n)\n")
+
+
+def decode_code(content, errors="strict"):
+    """
+    Decodes the raw file content once. The result equals the blob lines, each with its own line ending,
+    joined with "\\n": method texts and the parse cache entries are based on this form.
+    Line spans of the methods are numbers of the file lines, see lines_span.
+
+    :param errors: decoding error policy, as in bytes.decode.
+    """
+    return _LINE_END.sub("\\1\n", content.decode(errors=errors))
+
+
+def line_starts(code):
+    """Returns offsets where the lines of the file start in the code decoded by decode_code."""
+    return [0] + [match.end() for match in _DECODED_LINE_END.finditer(code)]
+
+
+def lines_span(starts, start, stop):
+    """
+    Returns numbers of the first and the last line of the file spanned by code[start:stop + 1]
+    of the code decoded by decode_code.
+    ANTLR line numbers cannot be used, as decode_code adds a "\n" after every line ending.
+
+    :param starts: line starts of the code, see line_starts.
+    """
+    return bisect.bisect_right(starts, start), bisect.bisect_right(starts, stop)
+
+
 class JavaFile:
-    def __init__(self, lines):
-        self.lines = [line.decode() for line in lines]
-        code = "\n".join(self.lines)
-        codeStream = InputStream(code)
-        lexer = JavaLexer(codeStream)
-        self.tokens_stream = CommonTokenStream(lexer)
-        self.parser = JavaParser(self.tokens_stream)
-        self.tree = self.parser.compilationUnit()
+    def __init__(self, code, two_stage=True):
+        """
+        :param code: decoded java code, see decode_code.
+        :param two_stage: parse the file in the fast SLL prediction mode first and
+            fall back to the full LL prediction mode only if SLL fails. Otherwise LL is used from the start.
+        """
+        self.code = code
+        self.tree, self.sll_failed = get_factory().parse(self.code, two_stage)
+        self.__summary = None
 
     def _walk_file(self, listener):
         ParseTreeWalker.DEFAULT.walk(listener, self.tree)
         return listener
 
+    def summary(self):
+        """
+        Walks through the parse tree once and returns everything known about the file.
+
+        :rtype JavaFileSummary
+        """
+        if self.__summary is None:
+            self.__summary = self._walk_file(JavaFileSummaryListener(self.code)).summary
+        return self.__summary
+
     def count_classes(self):
-        listener = self._walk_file(ClassCountingListener())
-        return listener.count
+        return self.summary().classes_count
 
     def count_methods(self):
-        listener = self._walk_file(MethodsCountingListener(self.tokens_stream))
-        return listener.count
+        return self.summary().methods_count
 
     def eval_blocks(self):
-        listener = self._walk_file(MethodsCountingListener(self.tokens_stream))
-        return listener.blocks
+        return self.summary().methods
+
+
+class ScanError(Exception):
+    pass
+
+
+class JavaFileScanner:
+    """
+    Fast alternative to JavaFile, which finds top-level method declarations in the JavaLexer token stream
+    without building the parse tree. Produces the same methods as JavaFile.eval_blocks for valid java code,
+    raises ScanError on the code it does not understand.
+    """
+    MODIFIERS = {JavaLexer.PUBLIC, JavaLexer.PROTECTED, JavaLexer.PRIVATE, JavaLexer.STATIC, JavaLexer.ABSTRACT,
+                 JavaLexer.FINAL, JavaLexer.STRICTFP, JavaLexer.NATIVE, JavaLexer.SYNCHRONIZED, JavaLexer.TRANSIENT,
+                 JavaLexer.VOLATILE, JavaLexer.DEFAULT}
+    # bodies, whose methods are counted by JavaFileSummaryListener
+    METHOD_OWNERS = {"class", "enum", "anonymous"}
+
+    def __init__(self, code):
+        self.__line_starts = line_starts(code)
+        self.__tokens = get_factory().tokens(code)
+        self.__positions = [i for i, token in enumerate(self.__tokens) if token.channel == Token.DEFAULT_CHANNEL]
+        self.__types = [self.__tokens[i].type for i in self.__positions] + [Token.EOF]
+        self.__blocks = None
+
+    def eval_blocks(self):
+        if self.__blocks is None:
+            self.__blocks = []
+            self.__scan_compilation_unit()
+        return self.__blocks
+
+    def __type(self, p):
+        if p >= len(self.__types):
+            raise ScanError("unexpected end of file")
+        return self.__types[p]
+
+    def __text(self, first, last):
+        return "".join([token.text for token in self.__tokens[self.__positions[first]:self.__positions[last] + 1]])
+
+    def __lines_span(self, first, last):
+        return lines_span(self.__line_starts, self.__tokens[self.__positions[first]].start,
+                          self.__tokens[self.__positions[last]].stop)
+
+    def __skip_balanced(self, p):
+        """Skips the brackets starting at p, returns the position after the closing one."""
+        opening = self.__type(p)
+        closing = {JavaLexer.LPAREN: JavaLexer.RPAREN, JavaLexer.LBRACE: JavaLexer.RBRACE,
+                   JavaLexer.LT: JavaLexer.GT}[opening]
+        depth = 0
+        while True:
+            t = self.__type(p)
+            if t == opening:
+                depth += 1
+            elif t == closing:
+                depth -= 1
+                if depth == 0:
+                    return p + 1
+            elif t == Token.EOF:
+                raise ScanError("unbalanced brackets")
+            p += 1
+
+    def __skip_annotation(self, p):
+        p += 1
+        while self.__type(p) in (JavaLexer.IDENTIFIER, JavaLexer.DOT):
+            p += 1
+        if self.__type(p) == JavaLexer.LPAREN:
+            p = self.__skip_balanced(p)
+        return p
+
+    def __skip_until(self, p, types):
+        while self.__type(p) not in types:
+            if self.__type(p) == Token.EOF:
+                raise ScanError("unexpected end of file")
+            p += 1
+        return p
+
+    def __scan_compilation_unit(self):
+        p = 0
+        while self.__type(p) != Token.EOF:
+            t = self.__type(p)
+            if t in (JavaLexer.PACKAGE, JavaLexer.IMPORT):
+                p = self.__skip_until(p, {JavaLexer.SEMI}) + 1
+            elif t in self.MODIFIERS or t == JavaLexer.SEMI:
+                p += 1
+            elif t == JavaLexer.AT and self.__type(p + 1) != JavaLexer.INTERFACE:
+                p = self.__skip_annotation(p)
+            else:
+                p = self.__scan_type_declaration(p, [])
+
+    def __scan_type_declaration(self, p, nested_in):
+        """Scans class, enum, interface or annotation declaration starting at p, returns the position after it."""
+        kinds = {JavaLexer.CLASS: "class", JavaLexer.ENUM: "enum", JavaLexer.INTERFACE: "interface",
+                 JavaLexer.AT: "annotation"}
+        if self.__type(p) not in kinds:
+            raise ScanError("type declaration expected")
+        kind = kinds[self.__type(p)]
+        if kind == "annotation":
+            p += 1
+        if self.__type(p + 1) != JavaLexer.IDENTIFIER:
+            raise ScanError("type name expected")
+        if kind == "class":
+            nested_in = nested_in + [self.__text(p + 1, p + 1)]
+        p = self.__skip_until(p, {JavaLexer.LBRACE})
+        return self.__scan_type_body(p + 1, kind, nested_in)
+
+    def __scan_type_body(self, p, kind, nested_in):
+        """Scans body members starting at p, returns the position after the closing brace."""
+        if kind == "enum":
+            p = self.__scan_enum_constants(p, nested_in)
+        while self.__type(p) != JavaLexer.RBRACE:
+            if self.__type(p) == JavaLexer.SEMI:
+                p += 1
+            else:
+                p = self.__scan_member(p, kind, nested_in)
+        return p + 1
+
+    def __scan_enum_constants(self, p, nested_in):
+        while True:
+            t = self.__type(p)
+            if t == JavaLexer.AT:
+                p = self.__skip_annotation(p)
+            elif t == JavaLexer.IDENTIFIER:
+                p += 1
+                if self.__type(p) == JavaLexer.LPAREN:
+                    p = self.__scan_code(p + 1, nested_in, JavaLexer.RPAREN) + 1
+                if self.__type(p) == JavaLexer.LBRACE:
+                    p = self.__scan_type_body(p + 1, "anonymous", nested_in)
+            elif t == JavaLexer.COMMA:
+                p += 1
+            elif t == JavaLexer.SEMI:
+                return p + 1
+            elif t == JavaLexer.RBRACE:
+                return p
+            else:
+                raise ScanError("enum constant expected")
+
+    def __scan_member(self, p, kind, nested_in):
+        """Scans a class body declaration starting at p, returns the position after it."""
+        while True:
+            t = self.__type(p)
+            if t in self.MODIFIERS:
+                p += 1
+            elif t == JavaLexer.AT and self.__type(p + 1) != JavaLexer.INTERFACE:
+                p = self.__skip_annotation(p)
+            else:
+                break
+
+        t = self.__type(p)
+        if t == JavaLexer.LBRACE:
+            # initializer block
+            return self.__scan_code(p + 1, nested_in, JavaLexer.RBRACE) + 1
+        if t in (JavaLexer.CLASS, JavaLexer.ENUM, JavaLexer.INTERFACE, JavaLexer.AT):
+            return self.__scan_type_declaration(p, nested_in)
+        if t == JavaLexer.LT:
+            p = self.__skip_balanced(p)
+
+        type_start = p
+        while self.__type(p) not in (JavaLexer.LPAREN, JavaLexer.ASSIGN, JavaLexer.SEMI):
+            t = self.__type(p)
+            if t == JavaLexer.LT:
+                p = self.__skip_balanced(p)
+            elif t == JavaLexer.AT:
+                p = self.__skip_annotation(p)
+            elif t in (JavaLexer.LBRACE, JavaLexer.RBRACE, Token.EOF):
+                raise ScanError("member declaration expected")
+            else:
+                p += 1
+
+        if self.__type(p) == JavaLexer.ASSIGN:
+            # field with an initializer, which can contain anonymous classes
+            return self.__scan_code(p + 1, nested_in, JavaLexer.SEMI) + 1
+        if self.__type(p) == JavaLexer.SEMI:
+            return p + 1
+
+        name = p - 1
+        if name < type_start or self.__type(name) != JavaLexer.IDENTIFIER:
+            raise ScanError("method name expected")
+        p = self.__skip_until(self.__skip_balanced(p), {JavaLexer.LBRACE, JavaLexer.SEMI})
+        if name == type_start:
+            # constructor
+            return self.__scan_code(p + 1, nested_in, JavaLexer.RBRACE) + 1
+
+        stop = p
+        if self.__type(p) == JavaLexer.LBRACE:
+            stop = self.__skip_balanced(p) - 1
+        if kind in self.METHOD_OWNERS:
+            method = Method(self.__text(type_start, stop), ".".join(nested_in), self.__text(type_start, name - 1),
+                            lines_span=self.__lines_span(type_start, stop))
+            self.__blocks.append(method)
+        return stop + 1
+
+    def __is_class_creator(self, p):
+        """Checks whether the brace at p starts an anonymous class body, as in "new Type<T>(arguments) {"."""
+        if p == 0 or self.__type(p - 1) != JavaLexer.RPAREN:
+            return False
+        depth = 0
+        p -= 1
+        while True:
+            t = self.__type(p)
+            if t == JavaLexer.RPAREN:
+                depth += 1
+            elif t == JavaLexer.LPAREN:
+                depth -= 1
+                if depth == 0:
+                    break
+            p -= 1
+            if p < 0:
+                return False
+        p -= 1
+        while p >= 0:
+            t = self.__type(p)
+            if t == JavaLexer.NEW:
+                return True
+            if t == JavaLexer.GT:
+                depth = 0
+                while p >= 0:
+                    if self.__type(p) == JavaLexer.GT:
+                        depth += 1
+                    elif self.__type(p) == JavaLexer.LT:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    p -= 1
+            elif t not in (JavaLexer.IDENTIFIER, JavaLexer.DOT):
+                return False
+            p -= 1
+        return False
+
+    def __scan_code(self, p, nested_in, closing):
+        """
+        Scans code outside of method bodies (initializers, constructors, field values) starting at p
+        until the closing token. Looks for anonymous and local classes, whose methods are counted.
+        Returns the position of the closing token.
+        """
+        while True:
+            t = self.__type(p)
+            if t == closing:
+                return p
+            if t == Token.EOF or t in (JavaLexer.RPAREN, JavaLexer.RBRACE):
+                raise ScanError("unbalanced brackets")
+            if t == JavaLexer.LPAREN:
+                p = self.__scan_code(p + 1, nested_in, JavaLexer.RPAREN) + 1
+            elif t == JavaLexer.LBRACE:
+                if self.__is_class_creator(p):
+                    p = self.__scan_type_body(p + 1, "anonymous", nested_in)
+                else:
+                    p = self.__scan_code(p + 1, nested_in, JavaLexer.RBRACE) + 1
+            elif t in (JavaLexer.CLASS, JavaLexer.INTERFACE, JavaLexer.ENUM) and \
+                    (p == 0 or self.__type(p - 1) != JavaLexer.DOT):
+                p = self.__scan_type_declaration(p, nested_in)
+            else:
+                p += 1
+
+
+EXTRACTORS = ("antlr", "antlr-ll", "scanner")
+
+
+def extract_methods(content, extractor="antlr", decode_errors="strict"):
+    """
+    Returns top-level methods of the java file and counts the file in parse_statistics.
+
+    :param content: raw content of the file.
+    :type content: bytes
+    :param extractor: "antlr" builds the full parse tree with JavaFile trying the SLL prediction mode first,
+        "antlr-ll" builds it in the LL prediction mode only, "scanner" uses the faster JavaFileScanner
+        and falls back to JavaFile on the code the scanner does not understand.
+    :param decode_errors: decoding error policy, see decode_code.
+    """
+    parse_statistics["files"] += 1
+    code = decode_code(content, decode_errors)
+    if extractor == "scanner":
+        try:
+            return JavaFileScanner(code).eval_blocks()
+        except ScanError:
+            parse_statistics["scanner_fallbacks"] += 1
+    java_file = JavaFile(code, two_stage=extractor != "antlr-ll")
+    if java_file.sll_failed:
+        parse_statistics["sll_fallbacks"] += 1
+    return java_file.eval_blocks()
 
 
 class Method:
-    def __init__(self, code, location, return_type):
-        self.code = code.split("\n")
+    def __init__(self, code, location, return_type, signature=None, lines_span=None):
+        self.text = code
+        self.__lines = None
+        self.__digest = None
         self.file = None
-        self.signature = retrieve_signature(code)
+        # numbers of the first and the last line of the method in its file
+        self.lines_span = lines_span
+        self.signature = retrieve_signature(code) if signature is None else signature
         self.location = location
         self.return_type = return_type
         self.id = location + "." + self.signature
+
+    def __deepcopy__(self, memo):
+        # methods are not changed once they are collected, so copies of the collectors share them
+        return self
+
+    @property
+    def code(self):
+        """Lines of the method code, split on the first use."""
+        if self.__lines is None:
+            self.__lines = self.text.split("\n")
+        return self.__lines
+
+    @property
+    def digest(self):
+        """blake2b digest of the method code, computed on the first use. Methods with the same code have it equal."""
+        if self.__digest is None:
+            self.__digest = hashlib.blake2b(self.text.encode(), digest_size=16).digest()
+        return self.__digest
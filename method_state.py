@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class MethodStateStore:
+    """
+    Per-method state of the method collectors kept in columns indexed by the method id.
+    Method ids are dense integers, so every column is a NumPy array, which grows geometrically
+    when a larger id appears. One store can be shared by all collectors of a JavaMethodsDataCollector.
+    """
+
+    def __init__(self, capacity=1024):
+        self.__capacity = capacity
+        self.__size = 0
+        self.__columns = []
+        self.__fill_values = []
+
+    @property
+    def size(self):
+        """Number of method ids the columns hold, the largest reserved id plus one."""
+        return self.__size
+
+    def add_column(self, dtype, fill_value, width=None):
+        """
+        Adds a column where every method starts with fill_value.
+
+        :param width: if given, every method gets a row of width values instead of a single value.
+        :return: key of the column, see column.
+        :rtype int
+        """
+        self.__columns.append(np.full(self.__shape(self.__capacity, width), fill_value, dtype=dtype))
+        self.__fill_values.append(fill_value)
+        return len(self.__columns) - 1
+
+    def column(self, key):
+        """
+        Returns the column view over the reserved method ids.
+        The view is invalidated by the next reserve, which may reallocate the column.
+
+        :rtype numpy.ndarray
+        """
+        return self.__columns[key][:self.__size]
+
+    def reserve(self, method_id):
+        """Makes the columns hold the given method id."""
+        if method_id < self.__size:
+            return
+        self.__size = method_id + 1
+        if self.__size <= self.__capacity:
+            return
+        while self.__capacity < self.__size:
+            self.__capacity *= 2
+        for key, column in enumerate(self.__columns):
+            width = column.shape[1] if column.ndim == 2 else None
+            grown = np.full(self.__shape(self.__capacity, width), self.__fill_values[key], dtype=column.dtype)
+            grown[:len(column)] = column
+            self.__columns[key] = grown
+
+    @staticmethod
+    def __shape(capacity, width):
+        return capacity if width is None else (capacity, width)
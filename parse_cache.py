@@ -0,0 +1,92 @@
+import json
+import sqlite3
+import zlib
+
+from java_metrics import Method
+
+# version of the stored methods, blobs stored by other versions are dropped
+FORMAT_VERSION = 3
+
+
+class ParseCache:
+    """
+    Persistent storage of methods extracted from java blobs, shared between runs.
+    Git blob content never changes, so the blob sha is used as a key.
+    Methods found by different extractors or decoded with different error policies are stored separately.
+    The storage keeps at most max_entries blobs, the least recently used ones are evicted first.
+    """
+
+    def __init__(self, path, max_entries=1000000, extractor="antlr", decode_errors="strict"):
+        """
+        :param extractor: method extractor the stored methods are found by, see java_metrics.extract_methods.
+        :param decode_errors: decoding error policy the stored methods are decoded with, see java_metrics.decode_code.
+        """
+        self.max_entries = max_entries
+        self.extractor = extractor
+        self.decode_errors = decode_errors
+        self._connection = sqlite3.connect(path)
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != FORMAT_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS blobs")
+            self._connection.execute("PRAGMA user_version = %d" % FORMAT_VERSION)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS blobs (sha TEXT NOT NULL, extractor TEXT NOT NULL, "
+                                 "decode_errors TEXT NOT NULL, methods BLOB NOT NULL, last_used INTEGER NOT NULL, "
+                                 "PRIMARY KEY (sha, extractor, decode_errors))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+        self._clock = self._connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM blobs").fetchone()[0]
+        self._used = {}
+        self._added = 0
+
+    def __contains__(self, sha):
+        return self._connection.execute("SELECT 1 FROM blobs WHERE sha = ? AND extractor = ? AND decode_errors = ?",
+                                        (sha, self.extractor, self.decode_errors)).fetchone() is not None
+
+    def get(self, sha):
+        """
+        :return: list of methods extracted from the blob or None if the blob is not stored.
+        :rtype list[java_metrics.Method]
+        """
+        row = self._connection.execute("SELECT methods FROM blobs WHERE sha = ? AND extractor = ? "
+                                       "AND decode_errors = ?", (sha, self.extractor, self.decode_errors)).fetchone()
+        if row is None:
+            return None
+        self._clock += 1
+        self._used[sha] = self._clock
+        methods = json.loads(zlib.decompress(row[0]).decode())
+        return [Method(code, location, return_type, signature, tuple(lines_span) if lines_span else None)
+                for code, location, return_type, signature, lines_span in methods]
+
+    def put(self, sha, methods):
+        data = [[method.text, method.location, method.return_type, method.signature, method.lines_span]
+                for method in methods]
+        self._clock += 1
+        self._connection.execute("INSERT OR REPLACE INTO blobs (sha, extractor, decode_errors, methods, last_used) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (sha, self.extractor, self.decode_errors, zlib.compress(json.dumps(data).encode()),
+                                  self._clock))
+        self._added += 1
+        if self._added >= 1000:
+            self.flush()
+
+    def flush(self):
+        """Stores the pending changes on disk and evicts blobs over the size limit."""
+        self._connection.executemany("UPDATE blobs SET last_used = ? WHERE sha = ? AND extractor = ? "
+                                     "AND decode_errors = ?",
+                                     [(last_used, sha, self.extractor, self.decode_errors)
+                                      for sha, last_used in self._used.items()])
+        self._used = {}
+        self._added = 0
+        excess = self._connection.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._connection.execute("DELETE FROM blobs WHERE rowid IN "
+                                     "(SELECT rowid FROM blobs ORDER BY last_used LIMIT ?)", (excess,))
+        self._connection.commit()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
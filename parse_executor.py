@@ -0,0 +1,122 @@
+import collections
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import java_metrics
+from git_repo import read_contents
+from java_metrics import extract_methods, is_java_file
+from parser_factory import warm_up
+
+
+def parse_blob(content, extractor, decode_errors):
+    """
+    Executed in the worker processes.
+
+    :return: methods of the java file with the given raw content and the parse statistics of the file.
+    """
+    statistics_before = java_metrics.parse_statistics.copy()
+    methods = extract_methods(content, extractor, decode_errors)
+    return methods, java_metrics.parse_statistics - statistics_before
+
+
+class ParseExecutor:
+    """
+    Parses java blobs in a pool of worker processes.
+    Blobs changed in the upcoming commits can be submitted in advance with prefetch,
+    results are always returned in the order they were asked for, so they do not depend on the workers timing.
+    """
+
+    def __init__(self, workers=None, parse_cache=None, extractor="antlr", warm_up_samples=(), decode_errors="strict"):
+        """
+        :param workers: number of worker processes, the number of processors by default.
+        :param parse_cache: blobs stored in this cache are not prefetched.
+        :type parse_cache: parse_cache.ParseCache
+        :param extractor: name of the method extractor, see java_metrics.extract_methods.
+        :param warm_up_samples: java code parsed by every worker before the real work, see parser_factory.warm_up.
+        :param decode_errors: decoding error policy, see java_metrics.decode_code.
+        """
+        self.parse_cache = parse_cache
+        self.extractor = extractor
+        self.decode_errors = decode_errors
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(list(warm_up_samples),))
+        self._pending = {}
+        # sha of the last commit of every prefetched batch and the blobs wanted by the batch
+        self._batches = collections.deque()
+
+    def prefetch(self, commits):
+        """
+        Starts parsing of the java files changed in the given commits.
+        Their blobs are read at once, in the order they are stored in the packs.
+        The changes of the commits are kept by the commits, so the collectors do not compare the trees again,
+        see git_repo.Commit.changes.
+        The parses not taken by parse are dropped, when the last of the commits is released, see release.
+        """
+        files = {}
+        wanted = set()
+        for commit in commits:
+            for file in commit.changes(is_java_file)[0]:
+                if file.sha in self._pending or file.sha in files:
+                    wanted.add(file.sha)
+                    continue
+                if self.parse_cache is not None and file.sha in self.parse_cache:
+                    continue
+                files[file.sha] = file
+                wanted.add(file.sha)
+        files = list(files.values())
+        for file, content in zip(files, read_contents(files)):
+            self._pending[file.sha] = self._pool.submit(parse_blob, content, self.extractor, self.decode_errors)
+        if commits:
+            self._batches.append((commits[-1].sha, wanted))
+
+    def release(self, commit):
+        """
+        Tells that the prefetched commit was passed, whether its files were parsed or not.
+        Once the last commit of a batch is passed, the parses of the batch which were not taken by parse
+        and are not wanted by the later batches are dropped.
+        """
+        if not self._batches or self._batches[0][0] != commit.sha:
+            return
+        _, wanted = self._batches.popleft()
+        wanted_later = set().union(*(blobs for _, blobs in self._batches))
+        for sha in wanted - wanted_later:
+            future = self._pending.pop(sha, None)
+            if future is not None:
+                future.cancel()
+
+    def parse(self, files):
+        """
+        :param files: java files to be parsed.
+        :type files: list[git_repo.Object]
+        :return: list of the files methods in the same order as files.
+        :rtype list[list[java_metrics.Method]]
+        """
+        # files sharing a blob are parsed once
+        not_pending = list({file.sha: file for file in files if file.sha not in self._pending}.values())
+        for file, content in zip(not_pending, read_contents(not_pending)):
+            self._pending[file.sha] = self._pool.submit(parse_blob, content, self.extractor, self.decode_errors)
+        futures = [self._pending[file.sha] for file in files]
+        for file in files:
+            self._pending.pop(file.sha, None)
+        result = []
+        done = set()
+        for future in futures:
+            methods, statistics = future.result()
+            if future in done:
+                # the same blob under another path: methods have to know their own file
+                methods = [copy.copy(method) for method in methods]
+            else:
+                java_metrics.parse_statistics.update(statistics)
+                done.add(future)
+            result.append(methods)
+        return result
+
+    def close(self):
+        self._pool.shutdown()
+        self._pending = {}
+        self._batches.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
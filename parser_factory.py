@@ -0,0 +1,74 @@
+from antlr4 import *
+from antlr4.error.ErrorListener import ConsoleErrorListener
+from antlr4.error.ErrorStrategy import DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+
+from antlr_java_parser.JavaLexer import JavaLexer
+from antlr_java_parser.JavaParser import JavaParser
+
+
+class ParserFactory:
+    """
+    Keeps one JavaLexer and one JavaParser and resets them for every new file instead of creating new ones.
+    The ATN and the DFA cache are shared by all instances of the generated classes in the process,
+    so the DFA states computed for the previous files speed up the following ones.
+    Not thread-safe: a tree returned by parse stays valid, but the factory is reused by the next call.
+    """
+
+    def __init__(self):
+        self.lexer = JavaLexer(InputStream(""))
+        self.tokens_stream = CommonTokenStream(self.lexer)
+        self.parser = JavaParser(self.tokens_stream)
+
+    def tokens(self, code):
+        """Returns all tokens of the code, including the hidden ones."""
+        self.lexer.inputStream = InputStream(code)
+        return self.lexer.getAllTokens()
+
+    def parse(self, code, two_stage=True):
+        """
+        Builds the compilation unit parse tree of the code.
+
+        :param two_stage: parse the code in the fast SLL prediction mode first and
+            fall back to the full LL prediction mode only if SLL fails. Otherwise LL is used from the start.
+        :return: parse tree and whether SLL failed
+        """
+        self.lexer.inputStream = InputStream(code)
+        self.tokens_stream.setTokenSource(self.lexer)
+        self.parser.setTokenStream(self.tokens_stream)
+        sll_failed = False
+        if two_stage:
+            self.parser._interp.predictionMode = PredictionMode.SLL
+            self.parser._errHandler = BailErrorStrategy()
+            self.parser.removeErrorListeners()
+            try:
+                return self.parser.compilationUnit(), sll_failed
+            except ParseCancellationException:
+                sll_failed = True
+            self.parser.reset()
+        self.parser._interp.predictionMode = PredictionMode.LL
+        self.parser._errHandler = DefaultErrorStrategy()
+        self.parser.removeErrorListeners()
+        self.parser.addErrorListener(ConsoleErrorListener.INSTANCE)
+        return self.parser.compilationUnit(), sll_failed
+
+
+_factory = None
+
+
+def get_factory():
+    """Returns the parser factory of the current process."""
+    global _factory
+    if _factory is None:
+        _factory = ParserFactory()
+    return _factory
+
+
+def warm_up(samples):
+    """
+    Parses the sample codes to fill the DFA cache of the process before the real work starts.
+    Used as an initializer of the worker processes.
+    """
+    factory = get_factory()
+    for code in samples:
+        factory.parse(code)
@@ -0,0 +1,77 @@
+import difflib
+
+MODES = ("exact", "lines", "quick", "real-quick")
+
+
+def _is_junk(char):
+    return char in " \t"
+
+
+def ratio(a, b, mode="exact"):
+    """
+    Returns similarity of two texts from 0 to 1. Identical texts are 1 in every mode and are not compared.
+
+    :param mode: "exact" is difflib.SequenceMatcher ratio over the characters with spaces and tabs as junk,
+        "lines" is the share of the lines in the longest common subsequence of the lines,
+        found by the Myers O(ND) difference algorithm. "quick" and "real-quick" are the faster
+        difflib quick_ratio and real_quick_ratio upper bounds of the "exact" ratio.
+    """
+    if a is b or a == b:
+        return 1.0
+    if mode == "lines":
+        return lines_ratio(a.split("\n"), b.split("\n"))
+    matcher = difflib.SequenceMatcher(isjunk=_is_junk, a=a, b=b)
+    if mode == "quick":
+        return matcher.quick_ratio()
+    if mode == "real-quick":
+        return matcher.real_quick_ratio()
+    return matcher.ratio()
+
+
+def lines_ratio(a, b):
+    """
+    :param a: lines of the first text.
+    :param b: lines of the second text.
+    :return: 2 * (length of the longest common subsequence) / (total number of lines)
+    """
+    total = len(a) + len(b)
+    if total == 0:
+        return 1.0
+    return (total - edit_distance(a, b)) / total
+
+
+def edit_distance(a, b):
+    """
+    Returns the minimal number of elements deleted from a and inserted into it to turn it into b,
+    found by the Myers O(ND) difference algorithm. The common prefix and suffix are skipped first.
+    """
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a_end, b_end = len(a), len(b)
+    while a_end > start and b_end > start and a[a_end - 1] == b[b_end - 1]:
+        a_end -= 1
+        b_end -= 1
+    a = a[start:a_end]
+    b = b[start:b_end]
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return n + m
+
+    # furthest x reached on every diagonal k = x - y, shifted by offset
+    offset = n + m + 1
+    furthest = [0] * (2 * offset + 1)
+    for distance in range(n + m + 1):
+        for k in range(-distance, distance + 1, 2):
+            if k == -distance or (k != distance and furthest[offset + k - 1] < furthest[offset + k + 1]):
+                x = furthest[offset + k + 1]
+            else:
+                x = furthest[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            furthest[offset + k] = x
+            if x >= n and y >= m:
+                return distance
+    return n + m